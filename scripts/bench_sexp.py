@@ -0,0 +1,67 @@
+"""
+bench_sexp.py
+Copyright 2022 Adam Greig
+Licensed under the MIT licence, see LICENSE file for details.
+
+Benchmark the S-expression parser and emitter on one or more files.
+
+Usage: bench_sexp.py [files...] [--repeat N]
+
+With no files given, benchmarks the compiled agg-kicad.kicad_sym library.
+"""
+
+import os
+import time
+import argparse
+
+import sexp
+
+
+DEFAULT_FILE = os.path.normpath(os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir,
+    "agg-kicad.kicad_sym"))
+
+
+def best_of(repeat, fn, *args, **kwargs):
+    """Return the fastest of `repeat` runs of `fn`, in seconds."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def bench(path, repeat):
+    with open(path) as f:
+        text = f.read()
+    size = len(text.encode()) / 1e6
+    tree = sexp.parse(text, parse_nums=True)
+
+    results = [
+        ("parse", best_of(repeat, sexp.parse, text)),
+        ("parse_nums", best_of(repeat, sexp.parse, text, parse_nums=True)),
+        ("lazy", best_of(repeat, sexp.parse, text, lazy=True)),
+        ("generate", best_of(repeat, sexp.generate, tree)),
+    ]
+
+    print("{} ({:.2f} MB):".format(path, size))
+    for name, t in results:
+        print("    {:<12} {:8.3f} s {:8.2f} MB/s".format(name, t, size / t))
+
+
+def main(files, repeat):
+    for path in files or [DEFAULT_FILE]:
+        bench(path, repeat)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("files", type=str, nargs="*", help=
+                        "Files to benchmark, default agg-kicad.kicad_sym")
+    parser.add_argument("--repeat", type=int, default=5, help=
+                        "Number of runs per measurement, best is reported")
+    args = vars(parser.parse_args())
+    main(**args)
@@ -0,0 +1,256 @@
+"""
+build.py
+Copyright 2022 Adam Greig
+Licensed under the MIT licence, see LICENSE file for details.
+
+Run the build, compile, check and verify stages of the library in a single
+Python process, printing how long each stage took.
+
+Usage: build.py [target ...] [--verbose] [--jobs N] [--force]
+
+Targets are the same as in the Makefile: `all` (the default), `build`,
+`compile`, `check`, `verify` and the groups and individual stages they are
+made of, such as `build-mods` or `build-mod-ic`. As with make, each stage is
+only run once, and only the stages named are run, but stages which use the
+outputs of other requested stages always run after them.
+
+Each stage declares the files it reads and writes. Stages whose files have
+the same contents as when they last succeeded are skipped unless --force is
+given, and independent stages run at the same time, in up to --jobs
+processes. A report of the critical path through the stages is printed at
+the end.
+
+Running everything from one process means the interpreter, PyYAML and the
+generator modules are only loaded once, and later stages find the build
+caches already warm.
+"""
+
+import os
+import sys
+import argparse
+import functools
+
+import parallel
+import scheduler
+import buildcache
+import build_lib_connector
+import build_lib_ic
+import build_lib_power
+import build_lib_switch
+import build_mod_chip
+import build_mod_ic
+import build_mod_jsteh
+import build_mod_jstpa
+import build_mod_picoblade
+import build_mod_sil_dil
+import build_mod_tfml_sfml
+import compile_lib
+import compile_sym_lib_table
+import check_lib
+import check_mod
+
+
+ROOT = os.path.normpath(os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+LIBPATH = "lib/"
+PRETTYPATH = "agg.pretty/"
+COMPILED_LIB = "agg-kicad.kicad_sym"
+SYM_LIB_TABLE = "sym-lib-table"
+
+# Every stage depends on the scripts themselves.
+SCRIPTS = ["scripts/*.py"]
+SYMBOLS = ["lib/**/*.kicad_sym"]
+FOOTPRINTS = ["agg.pretty/*.kicad_mod"]
+
+# Groups of stages, as in the Makefile.
+GROUPS = {
+    "all": ["build", "compile", "check", "verify"],
+    "build": ["build-libs", "build-mods"],
+    "build-libs": ["build-lib-connector", "build-lib-ic", "build-lib-power",
+                   "build-lib-switch"],
+    "build-mods": ["build-mod-chip", "build-mod-ic", "build-mod-jstpa",
+                   "build-mod-sil-dil", "build-mod-jsteh",
+                   "build-mod-picoblade", "build-mod-tfml-sfml"],
+    "build-verify": ["verify-libs", "verify-mods"],
+    "verify-libs": ["verify-lib-connector", "verify-lib-ic",
+                    "verify-lib-power"],
+    "verify-mods": ["verify-mod-chip", "verify-mod-ic", "verify-mod-jstpa",
+                    "verify-mod-sil-dil", "verify-mod-jsteh",
+                    "verify-mod-picoblade"],
+    "compile": ["compile-lib", "compile-sym-lib-table"],
+    "compile-verify": ["verify-lib", "verify-sym-lib-table"],
+    "check": ["check-lib", "check-mod"],
+    "verify": ["build-verify", "compile-verify"],
+}
+
+
+class Stage:
+    """
+    One step of the build. `run` is called with the verbose option and
+    returns False on failure, and the stage is run after any of the stages
+    named in `after` which are also being run. `inputs` and `outputs` are
+    glob patterns for the files it reads and writes, besides the scripts, and
+    `extra` returns any other input as a string.
+    """
+    def __init__(self, name, run, after=(), inputs=(), outputs=(),
+                 extra=None):
+        self.name = name
+        self.run = run
+        self.after = after
+        self.inputs = SCRIPTS + list(inputs)
+        self.outputs = list(outputs)
+        self.extra = extra
+
+
+def stages():
+    """Return every stage, keyed by name."""
+    libs = GROUPS["build-libs"]
+    mods = GROUPS["build-mods"]
+    compiled = GROUPS["compile"]
+
+    # Stages are already run in parallel, so each builds in one process.
+    def lib(name, module, path):
+        return [
+            Stage("build-lib-" + name,
+                  lambda verbose: module.main(path),
+                  outputs=[path]),
+            Stage("verify-lib-" + name,
+                  lambda verbose: module.main(path, verify=True),
+                  after=libs, inputs=[path]),
+        ]
+
+    def mod(name, module, *paths):
+        configs = [os.path.join(path, "*.yaml") for path in paths]
+        return [
+            Stage("build-mod-" + name,
+                  lambda verbose: module.main(PRETTYPATH, *paths, jobs=1),
+                  inputs=configs, outputs=FOOTPRINTS),
+            Stage("verify-mod-" + name,
+                  lambda verbose: module.main(
+                      PRETTYPATH, *paths, verify=True, verbose=verbose,
+                      jobs=1),
+                  after=mods, inputs=configs + FOOTPRINTS),
+        ]
+
+    result = (
+        lib("connector", build_lib_connector, "lib/connector/conn.kicad_sym") +
+        lib("power", build_lib_power, "lib/power/power.kicad_sym") +
+        lib("switch", build_lib_switch, "lib/ui/switch.kicad_sym") +
+        mod("chip", build_mod_chip, "mod/chip") +
+        mod("ic", build_mod_ic, "mod/ic") +
+        mod("jsteh", build_mod_jsteh) +
+        mod("jstpa", build_mod_jstpa) +
+        mod("picoblade", build_mod_picoblade) +
+        mod("sil-dil", build_mod_sil_dil) +
+        mod("tfml-sfml", build_mod_tfml_sfml)
+    )
+    result += [
+        Stage("build-lib-ic",
+              lambda verbose: build_lib_ic.main(LIBPATH),
+              inputs=["lib/**/*.yaml"], outputs=SYMBOLS),
+        Stage("verify-lib-ic",
+              lambda verbose: build_lib_ic.main(
+                  LIBPATH, verify=True, verbose=verbose),
+              after=libs, inputs=["lib/**/*.yaml"] + SYMBOLS),
+        Stage("compile-lib",
+              lambda verbose: compile_lib.writelib(LIBPATH, COMPILED_LIB),
+              after=libs, inputs=SYMBOLS, outputs=[COMPILED_LIB],
+              # The compiled library names the git version it was built from
+              extra=lambda: compile_lib.git_version(LIBPATH)),
+        Stage("verify-lib",
+              lambda verbose: compile_lib.checklib(LIBPATH, COMPILED_LIB),
+              after=libs + compiled, inputs=SYMBOLS + [COMPILED_LIB]),
+        Stage("compile-sym-lib-table",
+              lambda verbose: compile_sym_lib_table.writetable(
+                  LIBPATH, SYM_LIB_TABLE),
+              after=libs, inputs=SYMBOLS, outputs=[SYM_LIB_TABLE]),
+        Stage("verify-sym-lib-table",
+              lambda verbose: compile_sym_lib_table.checktable(
+                  LIBPATH, SYM_LIB_TABLE),
+              after=libs + compiled, inputs=SYMBOLS + [SYM_LIB_TABLE]),
+        Stage("check-lib",
+              lambda verbose: check_lib.main(LIBPATH, PRETTYPATH, verbose,
+                                             jobs=1),
+              after=libs + mods, inputs=SYMBOLS + FOOTPRINTS),
+        Stage("check-mod",
+              lambda verbose: check_mod.main(PRETTYPATH, verbose, jobs=1),
+              after=mods, inputs=FOOTPRINTS),
+    ]
+    return {stage.name: stage for stage in result}
+
+
+STAGES = stages()
+
+
+def expand(targets, known):
+    """
+    Return the names of the stages making up `targets`, in order and without
+    repeats, raising ValueError for any unknown target.
+    """
+    names = []
+    for target in targets:
+        if target in GROUPS:
+            new = expand(GROUPS[target], known)
+        elif target in known:
+            new = [target]
+        else:
+            raise ValueError("Unknown target '{}'".format(target))
+        names += [name for name in new if name not in names]
+    return names
+
+
+def order(names, known):
+    """
+    Sort the stages `names` so each runs after any stage it must follow,
+    otherwise keeping them in the order given.
+    """
+    done = []
+    remaining = list(names)
+    while remaining:
+        for name in remaining:
+            after = known[name].after
+            if not any(dep in remaining for dep in after if dep != name):
+                done.append(name)
+                remaining.remove(name)
+                break
+    return done
+
+
+def run_stage(name, verbose=False):
+    """Run the stage called `name`, returning False if it failed."""
+    return STAGES[name].run(verbose)
+
+
+def main(targets, verbose=False, jobs=None, force=False):
+    try:
+        names = order(expand(targets or ["all"], STAGES), STAGES)
+    except ValueError as e:
+        print("Error: {}".format(e), file=sys.stderr)
+        return False
+    os.chdir(ROOT)
+
+    if jobs is None:
+        jobs = parallel.default_jobs()
+    manifest = buildcache.load("build", 2)
+    runner = functools.partial(run_stage, verbose=verbose)
+    try:
+        return scheduler.schedule(STAGES, names, runner, jobs, manifest,
+                                  force)
+    finally:
+        buildcache.save("build", manifest)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("targets", type=str, nargs="*", help=
+                        "Targets to run, default all")
+    parser.add_argument("--verbose", action="store_true", help=
+                        "Print out every file verified or checked")
+    parser.add_argument("--jobs", type=int, default=None, help=
+                        "Number of processes, default one per CPU")
+    parser.add_argument("--force", action="store_true", help=
+                        "Run every stage, even if its files are unchanged")
+    args = vars(parser.parse_args())
+    result = main(**args)
+    sys.exit(0 if result else 1)
@@ -10,6 +10,7 @@ rows and pins.
 import sys
 import os.path
 import sexp
+import sexp_diff
 
 def onerow(n):
     name = f'CONN_01x{n:02}'
@@ -114,6 +115,9 @@ def main(libpath, verify=False):
                 return True
 
     if verify:
+        if os.path.isfile(libpath):
+            for line in sexp_diff.explain(oldlib, lib):
+                print(" ", line, file=sys.stderr)
         return False
     else:
         with open(libpath, 'w') as f:
@@ -29,11 +29,13 @@ pins: list of lists of left and right pin groups
 
 import os
 import sys
-import yaml
-import fnmatch
 import argparse
 
 import sexp
+import sexp_diff
+import configs
+import gitutil
+import buildcache
 
 pin_types = {
     "in": "input",
@@ -261,44 +263,82 @@ def library(conf):
     return sexp.generate(out)
 
 
-def load_items(libpath):
+# Symbols are only regenerated when their config or existing output has
+# changed since they were last built, or when either of these scripts change.
+CACHE_VERSION = buildcache.script_version(__file__, sexp.__file__)
+
+
+def load_items(libpath, built=None):
+    """
+    Load the symbol configs in `libpath`, keyed by symbol name.
+    Symbols recorded in `built` as unchanged since they were last built
+    are not loaded, and map to None instead.
+    """
     config = {}
-    for dirpath, dirnames, files in os.walk(libpath):
-        dirnames.sort()
-        files.sort()
-        for fn in fnmatch.filter(files, "*.yaml"):
-            path = os.path.join(dirpath, fn)
-            with open(path) as f:
-                item = yaml.safe_load(f)
-                item["path"] = dirpath
-                config[item["name"]] = item
+    for conf in configs.load(libpath):
+        confpath = os.path.abspath(conf.path)
+        entry = built.get(confpath) if built else None
+        if buildcache.unchanged(entry, conf.hash):
+            config[entry["name"]] = None
+            continue
+        item = conf.item
+        item["path"] = conf.dirpath
+        item["confpath"] = confpath
+        item["hash"] = conf.hash
+        config[item["name"]] = item
     return config
 
 
-def main(libpath, verify=False, verbose=False):
-    config = load_items(libpath)
+def main(libpath, verify=False, verbose=False, changed_since=None,
+         paths=None):
+    cachename = buildcache.manifest_name("build_lib_ic", libpath)
+    manifest = buildcache.load(cachename, CACHE_VERSION)
+    built = manifest.setdefault("built", {})
+    if changed_since is not None:
+        paths = (paths or set()) | gitutil.changed_files(changed_since)
+    config = load_items(libpath, built)
+
     for name, conf in config.items():
+        # Skip symbols whose config and output are unchanged since built
+        if conf is None:
+            continue
+
         conf['name'] = name
         path = os.path.join(conf.get("path", ""), name.lower()+".kicad_sym")
 
+        # Skip symbols whose config and output were not selected
+        if not gitutil.selected(paths, conf['confpath'], path):
+            continue
+
         lib = library(conf)
 
         if verify and verbose:
             print("Verifying", path)
 
         # Check if anything has changed
+        oldlib = None
         if os.path.isfile(path):
             with open(path) as f:
                 oldlib = f.read()
-                if lib == oldlib:
-                    continue
+        if lib == oldlib:
+            built[conf['confpath']] = buildcache.record(
+                conf['hash'], path, name=name)
+            continue
 
         # If so, either verification failed or write the new files
         if verify:
+            if oldlib is not None:
+                for line in sexp_diff.explain(oldlib, lib):
+                    print(" ", line, file=sys.stderr)
+            buildcache.save(cachename, manifest)
             return False
         else:
             with open(path, "w") as f:
                 f.write(lib)
+            built[conf['confpath']] = buildcache.record(
+                conf['hash'], path, name=name)
+
+    buildcache.save(cachename, manifest)
 
     # If we finished and didn't return yet, verification has succeeded
     if verify:
@@ -313,7 +353,14 @@ if __name__ == "__main__":
                         "Verify libraries are up to date")
     parser.add_argument("--verbose", action="store_true", help=
                         "Print out every library verified")
+    parser.add_argument("--changed-since", type=str, metavar="REV", help=
+                        "Only process configs changed since git revision REV")
+    parser.add_argument("--staged", action="store_true", help=
+                        "Only process configs and symbols staged in git")
+    parser.add_argument("--paths", type=str, nargs="+", metavar="PATH", help=
+                        "Only process these configs and symbols")
     args = vars(parser.parse_args())
+    args['paths'] = gitutil.selection(args.pop('staged'), args['paths'])
     result = main(**args)
     if args['verify']:
         if result:
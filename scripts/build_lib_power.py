@@ -10,6 +10,7 @@ import sys
 import os.path
 
 import sexp
+import sexp_diff
 
 PWR_NAMES = [
     "VCC", "VDD", "AVCC", "AVDD",
@@ -122,6 +123,9 @@ def main(libpath, verify=False):
 
     # If so, validation has failed or update the library file
     if verify:
+        if os.path.isfile(libpath):
+            for line in sexp_diff.explain(oldlib, lib):
+                print(" ", line, file=sys.stderr)
         return False
     else:
         with open(libpath, "w") as f:
@@ -47,11 +47,16 @@ import sys
 import time
 import math
 import argparse
-import yaml
-import fnmatch
 
-from sexp import parse as sexp_parse, generate as sexp_generate
+import sexp
+import kicad_mod
+import buildcache
+import configs
+import parallel
+import gitutil
+from sexp import generate as sexp_generate
 from kicad_mod import fp_line, fp_text, pad, draw_square, model
+from verify import check_footprint
 
 
 def refs(conf):
@@ -197,46 +202,97 @@ def footprint(conf):
     return sexp_generate(sexp)
 
 
-def load_items(modpath):
+# Footprints are only regenerated when their config or existing output has
+# changed since they were last built, or when any of these scripts change.
+CACHE_VERSION = buildcache.script_version(
+    __file__, sexp.__file__, kicad_mod.__file__)
+
+
+def load_items(modpath, built=None):
+    """
+    Load the footprint configs in `modpath`, keyed by footprint name.
+    Footprints recorded in `built` as unchanged since they were last built
+    are not loaded, and map to None instead.
+    """
     config = {}
-    for dirpath, dirnames, files in os.walk(modpath):
-        dirnames.sort()
-        files.sort()
-        for fn in fnmatch.filter(files, "*.yaml"):
-            path = os.path.join(dirpath, fn)
-            with open(path) as f:
-                item = yaml.safe_load(f)
-                item["path"] = dirpath
-                config[item["name"]] = item
+    for conf in configs.load(modpath):
+        confpath = os.path.abspath(conf.path)
+        entry = built.get(confpath) if built else None
+        if buildcache.unchanged(entry, conf.hash):
+            config[entry["name"]] = None
+            continue
+        item = conf.item
+        item["path"] = conf.dirpath
+        item["confpath"] = confpath
+        item["hash"] = conf.hash
+        config[item["name"]] = item
     return config
 
 
-def main(prettypath, modpath, verify=False, verbose=False):
-    config = load_items(modpath)
+def build(job):
+    """
+    Generate one footprint and compare it with any existing file, returning
+    its contents and a description of how it differs, or None.
+    """
+    conf, path = job
+
+    # Generate footprint
+    fp = footprint(conf)
+
+    # Check if the file already exists and isn't changed
+    difference = check_footprint(path, fp)
+    return fp, difference
+
+
+def main(prettypath, modpath, verify=False, verbose=False, jobs=None,
+         paths=None):
+    cachename = buildcache.manifest_name("build_mod_chip", prettypath)
+    manifest = buildcache.load(cachename, CACHE_VERSION)
+    built = manifest.setdefault("built", {})
+    config = load_items(modpath, built)
+
+    # Skip footprints whose config and output were not selected
     for name, conf in config.items():
-        # Generate footprint
-        conf['name'] = name
-        fp = footprint(conf)
         path = os.path.join(prettypath, name+".kicad_mod")
+        if conf is not None and not gitutil.selected(
+                paths, conf['confpath'], path):
+            config[name] = None
+
+    work = []
+    for name, conf in config.items():
+        if conf is not None:
+            conf['name'] = name
+            work.append((conf, os.path.join(prettypath, name+".kicad_mod")))
+    results = parallel.imap(build, work, jobs)
+
+    for name, conf in config.items():
+        path = os.path.join(prettypath, name+".kicad_mod")
+
+        # Skip footprints unchanged since built, or not selected
+        if conf is None:
+            continue
 
         if verify and verbose:
             print("Verifying", path)
 
-        # Check if an identical part already exists
-        if os.path.isfile(path):
-            with open(path) as f:
-                old = f.read()
-            old = [n for n in sexp_parse(old) if n[0] != "tedit"]
-            new = [n for n in sexp_parse(fp) if n[0] != "tedit"]
-            if new == old:
-                continue
+        fp, difference = next(results)
+        if difference is None:
+            built[conf['confpath']] = buildcache.record(
+                conf['hash'], path, name=name)
+            continue
 
         # If not, either verification failed or we should output the new fp
         if verify:
+            print(difference, file=sys.stderr)
+            buildcache.save(cachename, manifest)
             return False
         else:
             with open(path, "w") as f:
                 f.write(fp)
+            built[conf['confpath']] = buildcache.record(
+                conf['hash'], path, name=name)
+
+    buildcache.save(cachename, manifest)
 
     # If we finished and didn't return yet, verification has succeeded.
     if verify:
@@ -253,7 +309,14 @@ if __name__ == "__main__":
                         "Verify libraries are up to date")
     parser.add_argument("--verbose", action="store_true", help=
                         "Print out every library verified")
+    parser.add_argument("--jobs", type=int, default=None, help=
+                        "Number of processes, default one per CPU")
+    parser.add_argument("--staged", action="store_true", help=
+                        "Only process configs and footprints staged in git")
+    parser.add_argument("--paths", type=str, nargs="+", metavar="PATH", help=
+                        "Only process these configs and footprints")
     args = vars(parser.parse_args())
+    args['paths'] = gitutil.selection(args.pop('staged'), args['paths'])
     result = main(**args)
     if args['verify']:
         if result:
@@ -62,11 +62,17 @@ import time
 import math
 import subprocess
 import argparse
-import yaml
-import fnmatch
 
-from sexp import parse as sexp_parse, generate as sexp_generate
-from kicad_mod import fp_line, fp_arc, fp_circle, fp_text, pad, draw_square, model
+import sexp
+import kicad_mod
+import buildcache
+import configs
+import parallel
+import gitutil
+from sexp import generate as sexp_generate
+from kicad_mod import (fp_line, fp_arc, fp_circle, fp_text, pad, pad_block,
+                       draw_square, model)
+from verify import check_footprint
 
 
 def pin_centres(conf):
@@ -157,20 +163,19 @@ def bga_pin_centres(conf):
     default_letters = "ABCDEFGHJKLMNPRTUVWY"
     letters = conf.get("letters", default_letters)
     letters = list(letters) + [a+b for a in letters for b in letters]
-    skips = expand_skips(conf, letters)
+    skips = set(expand_skips(conf, letters))
     pitch = float(conf["pin_pitch"])
     out = []
     rows = int(conf['rows'])
     cols = int(conf['cols'])
-    for row in range(rows):
-        for col in range(cols):
-            rowid = letters[row]
-            colid = col + 1
+    # Every row shares the same x positions and every column the same y
+    xs = [(col * pitch) - ((cols-1)/2.0 * pitch) for col in range(cols)]
+    ys = [(row * pitch) - ((rows-1)/2.0 * pitch) for row in range(rows)]
+    for rowid, y in zip(letters, ys):
+        for colid, x in enumerate(xs, 1):
             padid = rowid + str(colid)
             if padid in skips:
                 continue
-            x = (col * pitch) - ((cols-1)/2.0 * pitch)
-            y = (row * pitch) - ((rows-1)/2.0 * pitch)
             out.append((padid, x, y))
     return out
 
@@ -497,59 +502,56 @@ def ctyd(conf):
     return sq
 
 
-def pad_row(centres, num, idx, shape, size, layers, skip):
+def pad_row(centres, num, idx, skip):
+    """
+    Number the pads at `centres`, leaving out any whose index is in `skip`.
+    Returns the next pad number and index, and a list of (num, x, y).
+    """
     out = []
-    for centre in centres:
+    for x, y in centres:
         idx += 1
         if idx - 1 in skip:
             continue
-        out.append(pad(num, "smd", shape, centre, size, layers))
+        out.append((num, x, y))
         num += 1
     return num, idx, out
 
 
 def pads(conf):
-    out = []
+    """Generate the text of every pad."""
+    out = ""
     layers = ["F.Cu", "F.Mask", "F.Paste"]
     size_lr = conf['pad_shape']
     size_tb = size_lr[1], size_lr[0]
     shape = "rect"
-    skip = conf.get('skip_pins', [])
+    skip = set(conf.get('skip_pins', []))
     leftr, btmr, rightr, topr = pin_centres(conf)
     num = 1
     idx = 1
 
-    num, idx, pins = pad_row(leftr, num, idx, shape, size_lr, layers, skip)
-    out += pins
-
-    if conf['rows'] == 4:
-        num, idx, pins = pad_row(btmr, num, idx, shape, size_tb, layers, skip)
-        out += pins
-
-    num, idx, pins = pad_row(rightr, num, idx, shape, size_lr, layers, skip)
-    out += pins
-
     if conf['rows'] == 4:
-        num, idx, pins = pad_row(topr, num, idx, shape, size_tb, layers, skip)
-        out += pins
+        rows = [(leftr, size_lr), (btmr, size_tb), (rightr, size_lr),
+                (topr, size_tb)]
+    else:
+        rows = [(leftr, size_lr), (rightr, size_lr)]
+    for centres, size in rows:
+        num, idx, pins = pad_row(centres, num, idx, skip)
+        out += pad_block(pins, "smd", shape, size, layers)
 
     # Exposed pad (potentially with separate mask/paste apertures)
     if "ep_shape" in conf:
-        out += exposed_pad(conf)
+        out += "".join(sexp_generate(p, 1) for p in exposed_pad(conf))
 
     return out
 
 
 def bga_pads(conf):
-    out = []
+    """Generate the text of every BGA ball."""
     layers = ["F.Cu", "F.Mask", "F.Paste"]
     size = [conf['pad_shape']]*2
     margin = (conf['mask_shape'] - conf['pad_shape']) / 2.0
-    for num, x, y in bga_pin_centres(conf):
-        p = pad(num, "smd", "circle", (x, y), size, layers)
-        p.append(["solder_mask_margin", margin])
-        out.append(p)
-    return out
+    return pad_block(bga_pin_centres(conf), "smd", "circle", size, layers,
+                     m_mask=margin)
 
 
 def _3d(conf):
@@ -567,9 +569,7 @@ def footprint(conf):
     sexp += fab(conf)
     sexp += silk(conf)
     sexp += ctyd(conf)
-    sexp += pads(conf)
-    sexp += _3d(conf)
-    return sexp_generate(sexp)
+    return generate(sexp, pads(conf), _3d(conf))
 
 
 def bga_footprint(conf):
@@ -580,9 +580,18 @@ def bga_footprint(conf):
     sexp += fab(conf)
     sexp += silk(conf)
     sexp += ctyd(conf)
-    sexp += bga_pads(conf)
-    sexp += _3d(conf)
-    return sexp_generate(sexp)
+    return generate(sexp, bga_pads(conf), _3d(conf))
+
+
+def generate(sexp, pads, rest):
+    """
+    Generate the footprint `sexp` followed by the already generated text of
+    its `pads` and then the nodes in `rest`.
+    """
+    # Each child is generated one level deep, so can be inserted directly
+    # before the footprint's closing bracket.
+    return (sexp_generate(sexp)[:-1] + pads +
+            "".join(sexp_generate(node, 1) for node in rest) + ")")
 
 
 def git_version(libpath):
@@ -591,54 +600,104 @@ def git_version(libpath):
     return git.stdout.read().decode().strip()
 
 
-def load_items(modpath):
+# Footprints are only regenerated when their config or existing output has
+# changed since they were last built, or when any of these scripts change.
+CACHE_VERSION = buildcache.script_version(
+    __file__, sexp.__file__, kicad_mod.__file__)
+
+
+def load_items(modpath, built=None):
+    """
+    Load the footprint configs in `modpath`, keyed by footprint name.
+    Footprints recorded in `built` as unchanged since they were last built
+    are not loaded, and map to None instead.
+    """
     config = {}
-    for dirpath, dirnames, files in os.walk(modpath):
-        dirnames.sort()
-        files.sort()
-        for fn in fnmatch.filter(files, "*.yaml"):
-            path = os.path.join(dirpath, fn)
-            with open(path) as f:
-                item = yaml.safe_load(f)
-                item["path"] = dirpath
-                config[item["name"]] = item
+    for conf in configs.load(modpath):
+        confpath = os.path.abspath(conf.path)
+        entry = built.get(confpath) if built else None
+        if buildcache.unchanged(entry, conf.hash):
+            config[entry["name"]] = None
+            continue
+        item = conf.item
+        item["path"] = conf.dirpath
+        item["confpath"] = confpath
+        item["hash"] = conf.hash
+        config[item["name"]] = item
     return config
 
 
-def main(prettypath, modpath, verify=False, verbose=False):
-    config = load_items(modpath)
+def build(job):
+    """
+    Generate one footprint and compare it with any existing file, returning
+    its contents and a description of how it differs, or None.
+    """
+    conf, path = job
+    if 'rows' in conf and 'pins' in conf:
+        assert conf['rows'] in (2, 4), \
+            "Must have either two or four rows"
+        assert conf['pins'] % conf['rows'] == 0, \
+            "Pins must equally divide among rows"
+        fp = footprint(conf)
+    elif 'rows' in conf and 'cols' in conf:
+        fp = bga_footprint(conf)
+    else:
+        raise ValueError("Must specify either rows+pins or rows+cols")
+
+    # Check if the file already exists and isn't changed
+    difference = check_footprint(path, fp)
+    return fp, difference
+
+
+def main(prettypath, modpath, verify=False, verbose=False, jobs=None,
+         paths=None):
+    cachename = buildcache.manifest_name("build_mod_ic", prettypath)
+    manifest = buildcache.load(cachename, CACHE_VERSION)
+    built = manifest.setdefault("built", {})
+    config = load_items(modpath, built)
+
+    # Skip footprints whose config and output were not selected
+    for name, conf in config.items():
+        path = os.path.join(prettypath, name+".kicad_mod")
+        if conf is not None and not gitutil.selected(
+                paths, conf['confpath'], path):
+            config[name] = None
+
+    work = []
+    for name, conf in config.items():
+        if conf is not None:
+            conf['name'] = name
+            work.append((conf, os.path.join(prettypath, name+".kicad_mod")))
+    results = parallel.imap(build, work, jobs)
+
     for name, conf in config.items():
-        conf['name'] = name
-        if 'rows' in conf and 'pins' in conf:
-            assert conf['rows'] in (2, 4), \
-                "Must have either two or four rows"
-            assert conf['pins'] % conf['rows'] == 0, \
-                "Pins must equally divide among rows"
-            fp = footprint(conf)
-        elif 'rows' in conf and 'cols' in conf:
-            fp = bga_footprint(conf)
-        else:
-            raise ValueError("Must specify either rows+pins or rows+cols")
         path = os.path.join(prettypath, name+".kicad_mod")
 
+        # Skip footprints unchanged since built, or not selected
+        if conf is None:
+            continue
+
         if verify and verbose:
             print("Verifying", path)
 
-        # Check if an identical part already exists
-        if os.path.isfile(path):
-            with open(path) as f:
-                old = f.read()
-            old = [n for n in sexp_parse(old) if n[0] != "tedit"]
-            new = [n for n in sexp_parse(fp) if n[0] != "tedit"]
-            if new == old:
-                continue
+        fp, difference = next(results)
+        if difference is None:
+            built[conf['confpath']] = buildcache.record(
+                conf['hash'], path, name=name)
+            continue
 
         # If not, either verification failed or we should output the new fp
         if verify:
+            print(difference, file=sys.stderr)
+            buildcache.save(cachename, manifest)
             return False
         else:
             with open(path, "w") as f:
                 f.write(fp)
+            built[conf['confpath']] = buildcache.record(
+                conf['hash'], path, name=name)
+
+    buildcache.save(cachename, manifest)
 
     # If we finished and didn't return yet, verification has succeeded.
     if verify:
@@ -655,7 +714,14 @@ if __name__ == "__main__":
                         "Verify libraries are up to date")
     parser.add_argument("--verbose", action="store_true", help=
                         "Print out every library verified")
+    parser.add_argument("--jobs", type=int, default=None, help=
+                        "Number of processes, default one per CPU")
+    parser.add_argument("--staged", action="store_true", help=
+                        "Only process configs and footprints staged in git")
+    parser.add_argument("--paths", type=str, nargs="+", metavar="PATH", help=
+                        "Only process these configs and footprints")
     args = vars(parser.parse_args())
+    args['paths'] = gitutil.selection(args.pop('staged'), args['paths'])
     result = main(**args)
     if args['verify']:
         if result:
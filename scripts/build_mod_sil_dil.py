@@ -39,14 +39,15 @@ font_halfheight = 0.7
 # End Settings ================================================================
 
 
-import os
 import sys
 import time
 import math
 import argparse
 
-from sexp import parse as sexp_parse, generate as sexp_generate
+import parallel
+from sexp import generate as sexp_generate
 from kicad_mod import fp_line, fp_text, pad, draw_square, model
+from verify import build_footprint
 
 
 def sil_pads(pins):
@@ -207,34 +208,29 @@ def kk(pins):
     return name, sexp_generate(sexp)
 
 
-def main(prettypath, verify=False, verbose=False):
+def main(prettypath, verify=False, verbose=False, jobs=None):
+    work = []
     for pins in list(range(1, 21)) + [25, 32, 36]:
         for generator in (sil, dil, kk):
             if generator == kk and (pins == 1 or pins > 16):
                 continue
 
-            # Generate footprint
-            name, fp = generator(pins)
-            path = os.path.join(prettypath, name + ".kicad_mod")
-
-            if verify and verbose:
-                print("Verifying", path)
-
-            # Check if the file already exists and isn't changed
-            if os.path.isfile(path):
-                with open(path) as f:
-                    old = f.read()
-                old = [n for n in sexp_parse(old) if n[0] != "tedit"]
-                new = [n for n in sexp_parse(fp) if n[0] != "tedit"]
-                if new == old:
-                    continue
-
-            # If it needs changing, either verification failed or we rewrite
-            if verify:
-                return False
-            else:
-                with open(path, "w") as f:
-                    f.write(fp)
+            work.append((prettypath, generator, pins))
+
+    for path, fp, difference in parallel.imap(build_footprint, work, jobs):
+        if verify and verbose:
+            print("Verifying", path)
+
+        if difference is None:
+            continue
+
+        # If it needs changing, either verification failed or we rewrite
+        if verify:
+            print(difference, file=sys.stderr)
+            return False
+        else:
+            with open(path, "w") as f:
+                f.write(fp)
 
     if verify:
         return True
@@ -248,6 +244,8 @@ if __name__ == "__main__":
                         "Verify libraries are up to date")
     parser.add_argument("--verbose", action="store_true", help=
                         "Print out every library verified")
+    parser.add_argument("--jobs", type=int, default=None, help=
+                        "Number of processes, default one per CPU")
     args = vars(parser.parse_args())
     result = main(**args)
     if args['verify']:
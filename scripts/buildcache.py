@@ -0,0 +1,113 @@
+"""
+buildcache.py
+Copyright 2022 Adam Greig
+Licensed under the MIT licence, see LICENSE file for details.
+
+On-disk manifests recording content hashes of build inputs and outputs, so
+that scripts can skip work whose inputs have not changed since the last run.
+
+Manifests are JSON files in the .cache directory at the top of the repository,
+which is safe to delete at any time. Manifests holding arbitrary Python
+objects, such as parsed configs, can be saved as pickles instead.
+"""
+
+import os
+import json
+import pickle
+import hashlib
+import tempfile
+
+
+CACHE_DIR = os.path.normpath(os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir, ".cache"))
+
+
+def hash_bytes(data):
+    """Return the hex SHA-256 digest of `data`."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_file(path):
+    """Return the hex SHA-256 digest of the file at `path`, or None."""
+    try:
+        with open(path, "rb") as f:
+            return hash_bytes(f.read())
+    except FileNotFoundError:
+        return None
+
+
+def script_version(*paths):
+    """
+    Return a single hash of the source files in `paths`, used as a manifest
+    version so cached results are discarded whenever the scripts change.
+    """
+    h = hashlib.sha256()
+    for path in paths:
+        with open(path, "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def manifest_name(prefix, path):
+    """Return a manifest name unique to `prefix` and the output `path`."""
+    return prefix + "-" + hash_bytes(os.path.abspath(path).encode())[:16]
+
+
+def load(name, version, binary=False):
+    """
+    Load the manifest called `name`, pickled if `binary` is set. If it does
+    not exist, cannot be read, or was saved with a different `version`,
+    returns a new empty manifest.
+    """
+    try:
+        if binary:
+            with open(os.path.join(CACHE_DIR, name + ".pickle"), "rb") as f:
+                manifest = pickle.load(f)
+        else:
+            with open(os.path.join(CACHE_DIR, name + ".json")) as f:
+                manifest = json.load(f)
+    except (OSError, ValueError, pickle.UnpicklingError, EOFError):
+        manifest = {}
+    if not isinstance(manifest, dict) or manifest.get("version") != version:
+        manifest = {"version": version}
+    return manifest
+
+
+def save(name, manifest, binary=False):
+    """
+    Atomically replace the manifest called `name`, pickled if `binary` is
+    set. The cache is only an optimisation, so failing to write it is
+    silently ignored.
+    """
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        fd, tmppath = tempfile.mkstemp(dir=CACHE_DIR, suffix=".tmp")
+        if binary:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(manifest, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmppath, os.path.join(CACHE_DIR, name + ".pickle"))
+        else:
+            with os.fdopen(fd, "w") as f:
+                json.dump(manifest, f)
+            os.replace(tmppath, os.path.join(CACHE_DIR, name + ".json"))
+    except OSError:
+        pass
+
+
+def record(input_hash, output_path, **info):
+    """
+    Return a manifest entry recording that `output_path`, as it is now, was
+    built from an input with hash `input_hash`, along with any extra `info`.
+    """
+    output_path = os.path.abspath(output_path)
+    return dict(info, input=input_hash, path=output_path,
+                output=hash_file(output_path))
+
+
+def unchanged(entry, input_hash):
+    """
+    Check whether the output recorded in manifest `entry` was built from an
+    input with hash `input_hash` and has not been modified since.
+    """
+    return (entry is not None and entry["input"] == input_hash
+            and entry["output"] == hash_file(entry["path"]))
@@ -11,7 +11,10 @@ import os
 import fnmatch
 import re
 import argparse
+import time
 import sexp
+import parallel
+import gitutil
 
 
 EXCLUDE = {
@@ -40,13 +43,14 @@ class Property:
         self.cfg = cfg
         self.key = cfg[1]
         self.val = cfg[2]
-        self.effects = [p for p in cfg if p and p[0] == 'effects'][0]
-        self.font = [p for p in self.effects if p and p[0] == 'font'][0]
-        self.font_size = [(float(p[1]), float(p[2])) for p in self.font
-                          if p[0] == 'size'][0]
+        self.effects = sexp.find(cfg, 'effects')
+        self.font = sexp.find(self.effects, 'font')
+        size = sexp.find(self.font, 'size')
+        self.font_size = (float(size[1]), float(size[2]))
         self.hidden = any(p == 'hide' for p in self.effects)
-        if any(p and p[0] == 'at' for p in cfg):
-            self.at = [p[1:] for p in cfg if p and p[0] == 'at'][0]
+        at = sexp.find(cfg, 'at')
+        if at is not None:
+            self.at = at[1:]
             self.x = float(self.at[0])
             self.y = float(self.at[1])
             self.rot = float(self.at[2])
@@ -59,13 +63,13 @@ class Pin:
         self.cfg = cfg
         self.etype = cfg[1]
         self.style = cfg[2]
-        self.at = [c[1:] for c in cfg if c and c[0] == 'at'][0]
+        self.at = sexp.find(cfg, 'at')[1:]
         self.x = float(self.at[0])
         self.y = float(self.at[1])
         self.rot = float(self.at[2])
-        self.length = [float(c[1]) for c in cfg if c and c[0] == 'length'][0]
-        self.prop_name = [Property(c) for c in cfg if c and c[0] == 'name'][0]
-        self.prop_num = [Property(c) for c in cfg if c and c[0] == 'number'][0]
+        self.length = float(sexp.find(cfg, 'length')[1])
+        self.prop_name = Property(sexp.find(cfg, 'name'))
+        self.prop_num = Property(sexp.find(cfg, 'number'))
         self.name = self.prop_name.key
         self.num = self.prop_num.key
 
@@ -73,22 +77,23 @@ class Pin:
 class Symbol:
     def __init__(self, cfg):
         assert cfg[0] == 'symbol'
+        idx = sexp.index(cfg)
         self.cfg = cfg
         self.name = cfg[1]
-        self.props = [Property(p) for p in cfg if p and p[0] == 'property']
+        self.props = [Property(p) for p in idx.find_all('property')]
         self.prop_ref = [p for p in self.props if p.key == 'Reference'][0]
         self.prop_val = [p for p in self.props if p.key == 'Value'][0]
         self.prop_fp  = [p for p in self.props if p.key == 'Footprint'][0]
         self.ref = self.prop_ref.val
         self.val = self.prop_val.val
         self.fp = self.prop_fp.val
-        self.pins = [Pin(p) for p in cfg if p and p[0] == 'pin']
-        self.polys = [p for p in cfg if p and p[0] == 'polyline']
-        self.rects = [p for p in cfg if p and p[0] == 'rectangle']
-        for subsym in [s for s in cfg if s and s[0] == 'symbol']:
-            self.pins += [Pin(p) for p in subsym if p and p[0] == 'pin']
-            self.polys += [p for p in subsym if p and p[0] == 'polyline']
-            self.rects += [p for p in subsym if p and p[0] == 'rectangle']
+        self.pins = [Pin(p) for p in idx.find_all('pin')]
+        self.polys = list(idx.find_all('polyline'))
+        self.rects = list(idx.find_all('rectangle'))
+        for subsym in idx.find_all('symbol'):
+            self.pins += [Pin(p) for p in sexp.find_all(subsym, 'pin')]
+            self.polys += list(sexp.find_all(subsym, 'polyline'))
+            self.rects += list(sexp.find_all(subsym, 'rectangle'))
 
 
 def is_multiple(n, m):
@@ -147,12 +152,10 @@ def check_drawings(symbol, exclusions, errs):
     if symbol.val == "IC" and 'missing_box' not in exclusions:
         got_box = False
         for rect in symbol.rects:
-            for p in rect:
-                if p[0] == 'fill':
-                    for q in p:
-                        if q[0] == 'type':
-                            if q[1] == "background":
-                                got_box = True
+            for fill in sexp.find_all(rect, 'fill'):
+                for filltype in sexp.find_all(fill, 'type'):
+                    if filltype[1] == "background":
+                        got_box = True
         if not got_box:
             errs.append("No background-filled box/poly found, but part is IC")
 
@@ -180,31 +183,56 @@ def check_fields(symbol, exclusions, errs, prettypath):
         errs.append(f"Footprint {symbol.fp} doesn't specify a library name")
 
 
-def checklib(libf, prettypath, verbose=False):
+# Rules timed by --profile, in the order they are run.
+RULES = ("parse", "check_symbols", "check_pins", "check_drawings",
+         "check_fields")
+
+
+def parse(libf):
+    """Parse the library `libf`, returning a list of its Symbols."""
+    contents = sexp.parse_file(libf)
+    return [Symbol(node) for node in contents if node[0] == 'symbol']
+
+
+def check(libf, prettypath, symbols=None):
+    """
+    Check the library `libf`, returning a list of errors and a dict of the
+    time in seconds spent in each of RULES, where parse includes building
+    the Symbol objects. If the library's `symbols` are given it is not
+    parsed again.
+    """
     errs = []
     exclusions = excludes(libf)
+    times = dict.fromkeys(RULES, 0.0)
 
-    with open(libf) as f:
-        contents = sexp.parse(f.read())
+    if symbols is None:
+        start = time.perf_counter()
+        symbols = parse(libf)
+        times["parse"] += time.perf_counter() - start
 
-    symbols = []
-    for node in contents:
-        if node[0] == 'symbol':
-            symbols.append(Symbol(node))
+    def timed(rule, *args):
+        start = time.perf_counter()
+        rule(*args)
+        times[rule.__name__] += time.perf_counter() - start
 
-    check_symbols(symbols, libf, exclusions, errs)
+    timed(check_symbols, symbols, libf, exclusions, errs)
 
     for symbol in symbols:
 
         # Check pins
-        check_pins(symbol, exclusions, errs)
+        timed(check_pins, symbol, exclusions, errs)
 
         # If part is an IC check at least one filled box/polyline is present
-        check_drawings(symbol, exclusions, errs)
+        timed(check_drawings, symbol, exclusions, errs)
 
         # Check fields
-        check_fields(symbol, exclusions, errs, prettypath)
+        timed(check_fields, symbol, exclusions, errs, prettypath)
+
+    return errs, times
+
 
+def report(libf, errs, verbose=False):
+    """Print the result of checking `libf`, returning True if it passed."""
     if len(errs) == 0:
         if verbose:
             print("Checked '{}': OK".format(libf))
@@ -217,16 +245,84 @@ def checklib(libf, prettypath, verbose=False):
         return False
 
 
-def main(libpath, prettypath, verbose=False):
-    ok = True
+def checklib(libf, prettypath, verbose=False):
+    errs, _ = check(libf, prettypath)
+    return report(libf, errs, verbose)
+
+
+def _check(job):
+    """Check one library in a worker process."""
+    libf, prettypath = job
+    return check(libf, prettypath)
+
+
+def print_profile(results):
+    """
+    Print the total time spent in each rule over every library, and the
+    libraries which took longest to check.
+    """
+    totals = dict.fromkeys(RULES, 0.0)
+    for _, times in results:
+        for rule, elapsed in times.items():
+            totals[rule] += elapsed
+    total = sum(totals.values()) or 1.0
+    print("Time per rule:")
+    for rule in sorted(RULES, key=totals.get, reverse=True):
+        print("  {:<16} {:7.3f}s {:5.1f}%".format(
+            rule, totals[rule], 100 * totals[rule] / total))
+    print("Slowest libraries:")
+    slowest = sorted(results, key=lambda r: sum(r[1].values()), reverse=True)
+    for libf, times in slowest[:5]:
+        worst = max(times, key=times.get)
+        print("  {:<48} {:7.3f}s, mostly {}".format(
+            libf, sum(times.values()), worst))
+
+
+def footprint_refs(paths, prettypath):
+    """
+    Return how libraries refer to each footprint in `prettypath` which is in
+    the selection `paths`, as bytes. Libraries referring to footprints which
+    were added, removed or renamed must be checked again too.
+    """
+    if paths is None:
+        return []
+    prettypath = os.path.abspath(prettypath)
+    return [b"agg:" + os.fsencode(os.path.splitext(os.path.basename(p))[0])
+            for p in paths
+            if p.endswith(".kicad_mod") and os.path.dirname(p) == prettypath]
+
+
+def refers(libf, refs):
+    """Check whether the library `libf` mentions any footprint in `refs`."""
+    if not refs:
+        return False
+    with open(libf, "rb") as f:
+        data = f.read()
+    return any(ref in data for ref in refs)
+
+
+def main(libpath, prettypath, verbose=False, jobs=None, profile=False,
+         paths=None):
+    refs = footprint_refs(paths, prettypath)
+    libs = []
     for dirpath, dirnames, files in os.walk(libpath):
         dirnames.sort()
         files.sort()
         for f in fnmatch.filter(files, "*.kicad_sym"):
             path = os.path.join(dirpath, f)
-            result = checklib(path, prettypath, verbose)
-            if not result:
-                ok = False
+            if gitutil.selected(paths, path) or refers(path, refs):
+                libs.append(path)
+
+    ok = True
+    timings = []
+    work = [(path, prettypath) for path in libs]
+    for path, (errs, times) in zip(libs, parallel.imap(_check, work, jobs)):
+        if not report(path, errs, verbose):
+            ok = False
+        timings.append((path, times))
+
+    if profile:
+        print_profile(timings)
     return ok
 
 if __name__ == "__main__":
@@ -238,6 +334,15 @@ if __name__ == "__main__":
     parser.add_argument("--verbose", action="store_true", help=
                         "Print out every library checked even if OK or "
                         "skipped.")
+    parser.add_argument("--jobs", type=int, default=None, help=
+                        "Number of processes, default one per CPU")
+    parser.add_argument("--profile", action="store_true", help=
+                        "Print the time spent in each rule")
+    parser.add_argument("--staged", action="store_true", help=
+                        "Only check libraries staged in git")
+    parser.add_argument("--paths", type=str, nargs="+", metavar="PATH", help=
+                        "Only check these libraries")
     args = vars(parser.parse_args())
+    args['paths'] = gitutil.selection(args.pop('staged'), args['paths'])
     result = main(**args)
     sys.exit(0 if result else 1)
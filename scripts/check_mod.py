@@ -11,10 +11,24 @@ from __future__ import print_function, division
 import sys
 import os
 import glob
-from decimal import Decimal
+import json
+import time
+from collections import namedtuple
+import xml.etree.ElementTree as ET
 import argparse
 
-from sexp import parse as sexp_parse
+import parallel
+import geometry
+import gitutil
+
+from sexp import (parse_file as sexp_parse_file, find as sexp_find,
+                  find_all as sexp_find_all)
+
+# Required sizes, in nanometres.
+FONT_SIZE = geometry.to_nm("1")
+FONT_THICKNESS = geometry.to_nm("0.15")
+CTYD_WIDTH = geometry.to_nm("0.01")
+CTYD_GRID = geometry.to_nm("0.05")
 
 SKIP = [
     "ael.pretty/ael_logo_10mm.kicad_mod",
@@ -24,21 +38,20 @@ SKIP = [
 
 
 def getwidth(item):
-    for node in item:
+    for node in sexp_find_all(item, "width", "stroke"):
         if node[0] == "width":
             return node
-        elif node[0] == "stroke":
-            for subnode in node:
-                if subnode[0] == "width":
-                    return subnode
+        width = sexp_find(node, "width")
+        if width is not None:
+            return width
     raise ValueError("No width found")
 
 
 def checkrefval(mod, errs):
-    for fp_text in (node for node in mod if node[0] == "fp_text"):
+    for fp_text in sexp_find_all(mod, "fp_text"):
         if fp_text[1] not in ("reference", "value"):
             continue
-        layer = [n for n in fp_text if n[0] == "layer"][0]
+        layer = sexp_find(fp_text, "layer")
         if layer[1] != "F.Fab":
             errs.append("Value and Reference fields must be on F.Fab")
         if fp_text[1] == "reference" and fp_text[2] != "REF**":
@@ -48,24 +61,26 @@ def checkrefval(mod, errs):
 
 
 def checkfont(mod, errs):
-    for fp_text in (node for node in mod if node[0] == "fp_text"):
-        effects = [n for n in fp_text if n[0] == "effects"][0]
-        font = [n for n in effects if n[0] == "font"][0]
-        size = [n for n in font if n[0] == "size"][0]
-        thickness = [n for n in font if n[0] == "thickness"][0]
-        if (Decimal(size[1]) != 1 or Decimal(size[2]) != 1):
+    for fp_text in sexp_find_all(mod, "fp_text"):
+        effects = sexp_find(fp_text, "effects")
+        font = sexp_find(effects, "font")
+        size = sexp_find(font, "size")
+        thickness = sexp_find(font, "thickness")
+        if (geometry.to_nm(size[1]) != FONT_SIZE
+                or geometry.to_nm(size[2]) != FONT_SIZE):
             errs.append("Font must all be 1mm x 1mm size")
-        if Decimal(thickness[1]) != Decimal("0.15"):
+        if geometry.to_nm(thickness[1]) != FONT_THICKNESS:
             errs.append("Font must be 0.15mm line thickness")
 
 
 def checklines(mod, errs, check_layers, check_width):
     line_types = ("fp_line", "fp_circle", "fp_arc", "fp_poly", "fp_curve")
-    for line in (node for node in mod if node[0] in line_types):
-        layer = [n for n in line if n[0] == "layer"][0]
+    nm = geometry.to_nm(check_width)
+    for line in sexp_find_all(mod, *line_types):
+        layer = sexp_find(line, "layer")
         width = getwidth(line)
         if layer[1] in check_layers:
-            if Decimal(width[1]) != Decimal(check_width):
+            if geometry.to_nm(width[1]) != nm:
                 errs.append("Lines on {} must be {}mm wide"
                             .format(check_layers, check_width))
 
@@ -73,84 +88,176 @@ def checklines(mod, errs, check_layers, check_width):
 def checkctyd(mod, errs):
     found_ctyd = False
     ctyd_layers = ("F.CrtYd", "B.CrtYd")
-    for ctyd in (node for node in mod if node[0] == "fp_line"):
-        layer = [n for n in ctyd if n[0] == "layer"][0]
-        start = [n for n in ctyd if n[0] == "start"][0]
-        end = [n for n in ctyd if n[0] == "end"][0]
+    for ctyd in sexp_find_all(mod, "fp_line"):
+        layer = sexp_find(ctyd, "layer")
+        start = sexp_find(ctyd, "start")
+        end = sexp_find(ctyd, "end")
         width = getwidth(ctyd)
         if layer[1] in ctyd_layers:
             found_ctyd = True
-            if Decimal(width[1]) != Decimal("0.01"):
+            if geometry.to_nm(width[1]) != CTYD_WIDTH:
                 errs.append("Courtyard lines must be 0.01mm wide")
-            if (Decimal(start[1]) % Decimal("0.05") != 0
-                    or Decimal(start[2]) % Decimal("0.05") != 0
-                    or Decimal(end[1]) % Decimal("0.05") != 0
-                    or Decimal(end[2]) % Decimal("0.05") != 0):
+            if not geometry.on_grid((start[1], start[2], end[1], end[2]),
+                                    CTYD_GRID):
                 errs.append("Courtyard lines must lie on a 0.05mm grid")
-    for ctyd in (node for node in mod if node[0] == "fp_rect"):
-        layer = [n for n in ctyd if n[0] == "layer"][0]
-        start = [n for n in ctyd if n[0] == "start"][0]
-        end = [n for n in ctyd if n[0] == "end"][0]
+    for ctyd in sexp_find_all(mod, "fp_rect"):
+        layer = sexp_find(ctyd, "layer")
+        start = sexp_find(ctyd, "start")
+        end = sexp_find(ctyd, "end")
         width = getwidth(ctyd)
         if layer[1] in ctyd_layers:
             found_ctyd = True
-            if Decimal(width[1]) != Decimal("0.01"):
+            if geometry.to_nm(width[1]) != CTYD_WIDTH:
                 errs.append("Courtyard lines must be 0.01mm wide")
-            if (Decimal(start[1]) % Decimal("0.05") != 0
-                    or Decimal(start[2]) % Decimal("0.05") != 0
-                    or Decimal(end[1]) % Decimal("0.05") != 0
-                    or Decimal(end[2]) % Decimal("0.05") != 0):
+            if not geometry.on_grid((start[1], start[2], end[1], end[2]),
+                                    CTYD_GRID):
                 errs.append("Courtyard lines must lie on a 0.05mm grid")
-    for ctyd in (node for node in mod if node[0] == "fp_circle"):
-        layer = [n for n in ctyd if n[0] == "layer"][0]
-        center = [n for n in ctyd if n[0] == "center"][0]
-        end = [n for n in ctyd if n[0] == "end"][0]
+    for ctyd in sexp_find_all(mod, "fp_circle"):
+        layer = sexp_find(ctyd, "layer")
+        center = sexp_find(ctyd, "center")
+        end = sexp_find(ctyd, "end")
         width = getwidth(ctyd)
         if layer[1] in ctyd_layers:
             found_ctyd = True
-            if Decimal(width[1]) != Decimal("0.01"):
+            if geometry.to_nm(width[1]) != CTYD_WIDTH:
                 errs.append("Courtyard lines must be 0.01mm wide")
-            if (Decimal(center[1]) % Decimal("0.05") != 0
-                    or Decimal(center[2]) % Decimal("0.05") != 0
-                    or Decimal(end[1]) % Decimal("0.05") != 0
-                    or Decimal(end[2]) % Decimal("0.05") != 0):
+            if not geometry.on_grid((center[1], center[2], end[1], end[2]),
+                                    CTYD_GRID):
                 errs.append("Courtyard lines must lie on a 0.05mm grid")
     if not found_ctyd:
         errs.append("No courtyard found")
 
 
-def checkmod(path, verbose=False):
-    errs = []
+# Each rule's name, check function and any extra arguments, in the order
+# they are run.
+RULES = (
+    ("refval", checkrefval, ()),
+    ("font", checkfont, ()),
+    ("silk_lines", checklines, (("F.SilkS", "B.SilkS"), "0.15")),
+    ("fab_lines", checklines, (("F.Fab", "B.Fab"), "0.01")),
+    ("ctyd", checkctyd, ()),
+)
+
+# One error found in a footprint.
+Result = namedtuple("Result", "path rule message")
+
 
-    with open(path) as f:
-        mod = sexp_parse(f.read())
+def check(path):
+    """
+    Check the footprint at `path`, returning a list of Results for any errors
+    and a dict of the time in seconds spent parsing and in each rule.
+    """
+    results = []
+    times = {}
 
-    checkrefval(mod, errs)
-    checkfont(mod, errs)
-    checklines(mod, errs, ("F.SilkS", "B.SilkS"), "0.15")
-    checklines(mod, errs, ("F.Fab", "B.Fab"), "0.01")
-    checkctyd(mod, errs)
+    start = time.perf_counter()
+    mod = sexp_parse_file(path)
+    times["parse"] = time.perf_counter() - start
 
-    if len(errs) == 0:
+    for rule, fn, args in RULES:
+        errs = []
+        start = time.perf_counter()
+        fn(mod, errs, *args)
+        times[rule] = time.perf_counter() - start
+        results += [Result(path, rule, err) for err in errs]
+
+    return results, times
+
+
+def report(path, results, verbose=False):
+    """Print the results of checking `path`, returning True if it passed."""
+    if len(results) == 0:
         if verbose:
             print("Checked '{}': OK".format(path))
         return True
     else:
         print("Checked '{}': Error:".format(path), file=sys.stderr)
-        for err in errs:
-            print("    " + err, file=sys.stderr)
+        for result in results:
+            print("    " + result.message, file=sys.stderr)
         print("", file=sys.stderr)
         return False
 
 
-def main(prettypath, verbose=False):
+def checkmod(path, verbose=False):
+    results, _ = check(path)
+    return report(path, results, verbose)
+
+
+def write_json(checked, path):
+    """
+    Write the errors and rule timings of each footprint in `checked`, a list
+    of (footprint path, results, times), to a JSON file at `path`.
+    """
+    out = {"footprints": [
+        {"path": fp, "ok": not results,
+         "errors": [{"rule": r.rule, "message": r.message} for r in results],
+         "times": times}
+        for fp, results, times in checked]}
+    with open(path, "w") as f:
+        json.dump(out, f, indent=2)
+
+
+def write_junit(checked, path):
+    """
+    Write a JUnit XML file to `path` with one test case per footprint in
+    `checked`, which fails listing every error found in it.
+    """
+    failures = sum(1 for _, results, _ in checked if results)
+    total = sum(sum(times.values()) for _, _, times in checked)
+    suite = ET.Element("testsuite", name="check_mod", tests=str(len(checked)),
+                       failures=str(failures), time="{:.6f}".format(total))
+    for fp, results, times in checked:
+        case = ET.SubElement(suite, "testcase", classname="check_mod",
+                             name=fp,
+                             time="{:.6f}".format(sum(times.values())))
+        if results:
+            failure = ET.SubElement(case, "failure",
+                                    message=results[0].message)
+            failure.text = "\n".join("{}: {}".format(r.rule, r.message)
+                                     for r in results)
+    ET.ElementTree(suite).write(path, encoding="utf-8", xml_declaration=True)
+
+
+def print_profile(checked):
+    """
+    Print the total time spent parsing and in each rule over every footprint,
+    and the footprints which took longest to check.
+    """
+    totals = {}
+    for _, _, times in checked:
+        for rule, elapsed in times.items():
+            totals[rule] = totals.get(rule, 0.0) + elapsed
+    total = sum(totals.values()) or 1.0
+    print("Time per rule:")
+    for rule in sorted(totals, key=totals.get, reverse=True):
+        print("  {:<16} {:7.3f}s {:5.1f}%".format(
+            rule, totals[rule], 100 * totals[rule] / total))
+    print("Slowest footprints:")
+    slowest = sorted(checked, key=lambda c: sum(c[2].values()), reverse=True)
+    for fp, _, times in slowest[:5]:
+        worst = max(times, key=times.get)
+        print("  {:<48} {:7.3f}s, mostly {}".format(
+            fp, sum(times.values()), worst))
+
+
+def main(prettypath, verbose=False, jobs=None, profile=False,
+         json_path=None, junit_path=None, paths=None):
+    fps = sorted(glob.glob(os.path.join(prettypath, "*.kicad_mod")))
+    fps = [f for f in fps if f not in SKIP and gitutil.selected(paths, f)]
+
     ok = True
-    for f in glob.glob(os.path.join(prettypath, "*.kicad_mod")):
-        if f in SKIP:
-            continue
-        result = checkmod(f, verbose)
-        if not result:
+    checked = []
+    for f, (results, times) in zip(fps, parallel.imap(check, fps, jobs)):
+        if not report(f, results, verbose):
             ok = False
+        checked.append((f, results, times))
+
+    if json_path is not None:
+        write_json(checked, json_path)
+    if junit_path is not None:
+        write_junit(checked, junit_path)
+    if profile:
+        print_profile(checked)
     return ok
 
 
@@ -160,6 +267,20 @@ if __name__ == "__main__":
                         help="Path to footprints")
     parser.add_argument("--verbose", action="store_true",
                         help="Print out every footprint checked even if OK")
+    parser.add_argument("--jobs", type=int, default=None,
+                        help="Number of processes, default one per CPU")
+    parser.add_argument("--profile", action="store_true",
+                        help="Print the time spent in each rule")
+    parser.add_argument("--json", type=str, dest="json_path", metavar="PATH",
+                        help="Also write the results as JSON to PATH")
+    parser.add_argument("--junit", type=str, dest="junit_path",
+                        metavar="PATH",
+                        help="Also write the results as JUnit XML to PATH")
+    parser.add_argument("--staged", action="store_true",
+                        help="Only check footprints staged in git")
+    parser.add_argument("--paths", type=str, nargs="+", metavar="PATH",
+                        help="Only check these footprints")
     args = vars(parser.parse_args())
+    args['paths'] = gitutil.selection(args.pop('staged'), args['paths'])
     result = main(**args)
     sys.exit(0 if result else 1)
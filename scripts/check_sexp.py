@@ -0,0 +1,163 @@
+"""
+check_sexp.py
+Copyright 2022 Adam Greig
+Licensed under the MIT licence, see LICENSE file for details.
+
+Check the s-expression parsers and emitter in sexp.py against the original
+character-by-character ones kept in sexp_reference.py, using every library
+and footprint file as test input.
+
+The whole-buffer parser `parse`, its lazy mode, `parse_file` and its
+memory-mapped lazy mode, the compact mode with and without lazy, and the
+chunked parsers `iterparse` and `iterchildren` must build the same tree as
+the reference parser, for every chunk size. The lookups of every compact
+Node must find the same children as scanning them. `generate` must give the
+same text as the reference emitter, and generating a parsed file must parse
+back to the same tree.
+"""
+
+import io
+import os
+import sys
+import glob
+import fnmatch
+import argparse
+
+import sexp
+import sexp_reference
+
+
+# Chunk sizes for iterparse, chosen to split tokens at many different places.
+CHUNK_SIZES = (7, 65536)
+
+
+def iterparse_tree(text, parse_nums, chunk_size):
+    """Build the complete tree for `text` using iterparse."""
+    root = None
+    events = sexp.iterparse(io.StringIO(text), parse_nums, chunk_size)
+    for event, node in events:
+        if root is None and event == "start":
+            root = node
+    return root
+
+
+def unpack(node):
+    """
+    Return the compact tree `node` as lists, or None if any list in it is not
+    a Node.
+    """
+    if type(node) is not sexp.Node:
+        return None
+    items = []
+    for child in node:
+        if isinstance(child, (list, tuple)):
+            child = unpack(child)
+            if child is None:
+                return None
+        items.append(child)
+    return items
+
+
+def lookups_agree(node):
+    """
+    Check that the find, find_all and has methods of every Node in `node`
+    return the same children as scanning them in order.
+    """
+    names = {child[0] for child in node if isinstance(child, tuple) and child}
+    for name in names | {"missing"}:
+        found = [child for child in node
+                 if isinstance(child, tuple) and child and child[0] == name]
+        if (node.find(name) is not (found[0] if found else None)
+                or list(node.find_all(name)) != found
+                or node.has(name) != bool(found)):
+            return False
+    named = [child for child in node if isinstance(child, tuple) and child]
+    if (node.find(*names) is not (named[0] if named else None)
+            or list(node.find_all(*names)) != named):
+        return False
+    return all(lookups_agree(child) for child in node
+               if isinstance(child, tuple))
+
+
+def checkfile(path, verbose=False):
+    errs = []
+
+    with open(path) as f:
+        text = f.read()
+
+    for parse_nums in (False, True):
+        tree = sexp_reference.parse(text, parse_nums)
+
+        def compare(engine, result):
+            if result != tree:
+                errs.append(f"{engine} with parse_nums={parse_nums} "
+                            f"differs from the reference parser")
+
+        compare("parse", sexp.parse(text, parse_nums))
+        for chunk_size in CHUNK_SIZES:
+            compare(f"iterparse(chunk_size={chunk_size})",
+                    iterparse_tree(text, parse_nums, chunk_size))
+        children = sexp.iterchildren(io.StringIO(text), parse_nums)
+        compare("iterchildren", tree[:1] + list(children))
+        compare("parse(lazy=True)",
+                list(sexp.parse(text, parse_nums, lazy=True)))
+        compare("parse_file", sexp.parse_file(path, parse_nums))
+        compare("parse_file(lazy=True)",
+                list(sexp.parse_file(path, parse_nums, lazy=True)))
+
+        compact = sexp.parse(text, parse_nums, compact=True)
+        compare("parse(compact=True)", unpack(compact))
+        lazy = sexp.parse(text, parse_nums, compact=True, lazy=True)
+        compare("parse(compact=True, lazy=True)",
+                [unpack(child) if isinstance(child, tuple) else child
+                 for child in lazy])
+        if not lookups_agree(compact):
+            errs.append(f"Node lookups with parse_nums={parse_nums} differ "
+                        f"from scanning their children")
+
+        if sexp.generate(tree) != sexp_reference.generate(tree):
+            errs.append(f"generate with parse_nums={parse_nums} differs "
+                        f"from the reference emitter")
+
+    tree = sexp_reference.parse(text)
+    if sexp_reference.parse(sexp.generate(tree)) != tree:
+        errs.append("Generated output does not parse back to the same tree")
+
+    if len(errs) == 0:
+        if verbose:
+            print("Checked '{}': OK".format(path))
+        return True
+    else:
+        print("Checked '{}': Error:".format(path), file=sys.stderr)
+        for err in errs:
+            print("    " + err, file=sys.stderr)
+        print("", file=sys.stderr)
+        return False
+
+
+def main(libpath, prettypath, verbose=False):
+    paths = []
+    for dirpath, dirnames, files in os.walk(libpath):
+        dirnames.sort()
+        for f in fnmatch.filter(sorted(files), "*.kicad_sym"):
+            paths.append(os.path.join(dirpath, f))
+    paths += sorted(glob.glob(os.path.join(prettypath, "*.kicad_mod")))
+
+    ok = True
+    for path in paths:
+        if not checkfile(path, verbose):
+            ok = False
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("libpath", type=str, help=
+                        "Path to libraries")
+    parser.add_argument("prettypath", type=str, help=
+                        "Path to footprints")
+    parser.add_argument("--verbose", action="store_true", help=
+                        "Print out every file checked even if OK")
+    args = vars(parser.parse_args())
+    result = main(**args)
+    sys.exit(0 if result else 1)
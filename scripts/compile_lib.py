@@ -5,18 +5,39 @@ Licensed under the MIT licence, see LICENSE file for details.
 
 Build a single KiCAD component library from multiple input libraries.
 
-Usage: compile_lib.py <lib path> <outfile> [--verify]
+Usage: compile_lib.py <lib path> <outfile> [--verify] [--extends]
+                      [--duplicates]
 
 With --verify, checks that <outfile> matches the library that would be
 generated, exits with 0 if match and 1 otherwise.
+
+With --extends, symbols whose pins and graphics are identical to an earlier
+symbol are written as derived symbols which extend it, keeping only their
+own properties. This makes the library smaller and quicker for KiCad to load,
+but is not used for the checked-in library.
+
+With --duplicates, nothing is written and instead the subtrees repeated in
+the compiled library are listed along with the bytes they take up.
+
+The content hash of each input library and the byte range of its symbols in
+<outfile> are recorded in .cache/, so the symbols of unchanged libraries are
+copied from the existing <outfile> instead of being parsed again, and --verify
+returns immediately when neither the inputs nor <outfile> have changed. When
+the new library is the same length as the old one, only the changed ranges
+are rewritten in place.
 """
 
+import io
 import sys
 import os
+import argparse
 import fnmatch
 import datetime
 import subprocess
+from collections import defaultdict
 import sexp
+import sexp_diff
+import buildcache
 
 
 def git_version(libpath):
@@ -33,62 +54,319 @@ def git_version(libpath):
     return git.stdout.read().decode().strip()
 
 
-def writelib(libpath, outpath):
-    newlib = compilelib(libpath)
-    with open(outpath, "w") as f:
-        f.write(newlib)
+# Cached symbol text depends on this script and on how sexp.py generates it
+CACHE_VERSION = buildcache.script_version(__file__, sexp.__file__)
 
 
-def checklib(libpath, outpath):
-    with open(outpath) as f:
-        old = f.read().split("\n")
-        new = compilelib(libpath).split("\n")
-        # Don't compare git versions
-        old[3] = new[3] = ""
-        return old == new
+def cachename(outpath):
+    return buildcache.manifest_name("compile_lib", outpath)
 
 
-def compilelib(libpath):
-    version = git_version(libpath)
-    out = ['kicad_symbol_lib',
-        ['version', 20211014],
-        ['generator', f'agg-kicad-compiled-{version}'],
-    ]
+def writelib(libpath, outpath, extends=False):
+    manifest = buildcache.load(cachename(outpath), CACHE_VERSION)
+    current = readlib(outpath)
+    old = current if recorded(current, manifest) else None
+    newlib = compilelib(libpath, manifest, extends, old)
+    splice(outpath, current, newlib, None if extends else ranges(manifest))
+    manifest["output"] = buildcache.hash_bytes(newlib)
+    manifest["extends"] = extends
+    buildcache.save(cachename(outpath), manifest)
+
+
+def checklib(libpath, outpath, extends=False):
+    manifest = buildcache.load(cachename(outpath), CACHE_VERSION)
+    if uptodate(libpath, outpath, manifest, extends):
+        return True
+    oldlib = readlib(outpath)
+    cached = oldlib if recorded(oldlib, manifest) else None
+    newlib = compilelib(libpath, manifest, extends, cached)
+    old = oldlib.split(b"\n")
+    new = newlib.split(b"\n")
+    # Don't compare git versions
+    old[3] = new[3] = b""
+    # Only record the output as up-to-date with the sources just compiled,
+    # whose symbols start wherever the old header ends.
+    if old == new:
+        manifest["output"] = buildcache.hash_bytes(oldlib)
+        manifest["extends"] = extends
+        manifest["header"] += len(oldlib) - len(newlib)
+    else:
+        manifest.pop("output", None)
+        explain(oldlib.decode(), newlib.decode())
+    buildcache.save(cachename(outpath), manifest)
+    return old == new
+
+
+def readlib(outpath):
+    """Return the contents of the compiled library `outpath`, or None."""
+    try:
+        with open(outpath, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
 
+def recorded(lib, manifest):
+    """
+    Check whether `lib` is the compiled library whose symbol ranges are
+    recorded in `manifest`. Libraries written with --extends have no such
+    ranges.
+    """
+    return (lib is not None and "header" in manifest
+            and not manifest.get("extends", False)
+            and manifest.get("output") == buildcache.hash_bytes(lib))
+
+
+def ranges(manifest):
+    """
+    Return the byte ranges of the header, of each library's symbols and of
+    the closing bracket in the compiled library, as recorded in `manifest`.
+    Together they cover the whole library.
+    """
+    header = manifest["header"]
+    spans = [(0, header)] + [
+        (header + entry["start"], header + entry["end"])
+        for entry in manifest["sources"].values()]
+    end = max(end for _, end in spans)
+    return spans + [(end, end + 1)]
+
+
+def splice(outpath, old, new, spans=None):
+    """
+    Replace the compiled library `old` at `outpath` with `new`. When both are
+    the same length and the byte ranges `spans` covering all of `new` are
+    given, only the spans which changed are written, in place. Otherwise the
+    whole library is written out at once.
+    """
+    if old is None or spans is None or len(old) != len(new):
+        with open(outpath, "wb") as f:
+            f.write(new)
+        return
+    with open(outpath, "r+b") as f:
+        for start, end in spans:
+            if old[start:end] != new[start:end]:
+                f.seek(start)
+                f.write(new[start:end])
+
+
+def explain(oldlib, newlib):
+    """Print how the libraries `oldlib` and `newlib` differ."""
+    for line in sexp_diff.explain(oldlib, newlib, ignore=("generator",)):
+        print(" ", line, file=sys.stderr)
+
+
+def uptodate(libpath, outpath, manifest, extends=False):
+    """
+    Check whether `outpath` and every library in `libpath` are unchanged since
+    `outpath` was last written or verified, using the hashes in `manifest`.
+    """
+    if manifest.get("output") != buildcache.hash_file(outpath):
+        return False
+    if manifest.get("extends", False) != extends:
+        return False
+    sources = manifest.get("sources", {})
+    keys = set()
+    for key, path in sourcepaths(libpath):
+        entry = sources.get(key)
+        if entry is None or entry["hash"] != buildcache.hash_file(path):
+            return False
+        keys.add(key)
+    return keys == set(sources)
+
+
+def sourcepaths(libpath):
+    """Yield the key and path of every library in `libpath`, in order."""
     for dirpath, dirnames, files in os.walk(libpath):
         dirnames.sort()
         for f in fnmatch.filter(sorted(files), "*.kicad_sym"):
-            with open(os.path.join(dirpath, f)) as libf:
-                part = sexp.parse(libf.read(), parse_nums=True)
-                if not part[2][1].startswith("agg-kicad-compiled"):
-                    out += part[3:]
+            path = os.path.join(dirpath, f)
+            yield os.path.relpath(path, libpath), path
 
-    return sexp.generate(out)
 
+def compilelib(libpath, manifest=None, extends=False, old=None):
+    """
+    Return the compiled library as UTF-8 bytes.
 
-def usage():
-    print("Usage: {} <lib path> <outfile> [--verify]".format(sys.argv[0]))
-    sys.exit(1)
+    The hash of each source library and the range of its symbols in the
+    result are recorded in `manifest`. Libraries whose hash is unchanged
+    have their symbols copied from `old`, the compiled library the ranges
+    already in `manifest` refer to, instead of being parsed again. With
+    `extends`, aliases are written as derived symbols, and every library is
+    parsed.
+    """
+    if manifest is None:
+        manifest = {}
+    cached = {}
+    if old is not None and not extends:
+        cached = manifest.get("sources", {})
+        start = manifest["header"]
+    sources = {}
+    symbols = []
+    offset = 0
+    for key, path in sourcepaths(libpath):
+        with open(path, "rb") as libf:
+            data = libf.read()
+        digest = buildcache.hash_bytes(data)
+        entry = cached.get(key)
+        if entry is not None and entry["hash"] == digest:
+            text = old[start + entry["start"]:start + entry["end"]]
+        else:
+            # Children are version, generator, then the symbols, which are
+            # each generated as soon as they are parsed.
+            children = sexp.iterchildren(io.StringIO(data.decode()),
+                                         parse_nums=True)
+            _version, generator = next(children), next(children)
+            text = b""
+            if not generator[1].startswith("agg-kicad-compiled"):
+                text = "".join(sexp.generate(sym, 1)
+                               for sym in children).encode()
+        sources[key] = {"hash": digest, "start": offset,
+                        "end": offset + len(text)}
+        symbols.append(text)
+        offset += len(text)
+    manifest["sources"] = sources
+
+    if extends:
+        lib = sexp.parse("(kicad_symbol_lib" + b"".join(symbols).decode()
+                         + ")", parse_nums=True)
+        symbols = [sexp.generate(sym, 1).encode() for sym in derive(lib[1:])]
+
+    version = git_version(libpath)
+    header = sexp.generate(['kicad_symbol_lib',
+        ['version', 20211014],
+        ['generator', f'agg-kicad-compiled-{version}'],
+    ])
+    # Each symbol is generated one level deep, so can be inserted directly
+    # before the header's closing bracket.
+    header = header[:-1].encode()
+    manifest["header"] = len(header)
+    return header + b"".join(symbols) + b")"
+
+
+def body(symbol):
+    """
+    Return the digest of everything in `symbol` but its name and properties,
+    with the symbol name removed from the names of its units, so symbols
+    which only differ in those have the same body.
+    """
+    name = symbol[1]
+    nodes = []
+    for node in symbol[2:]:
+        if node[0] == "property":
+            continue
+        if node[0] == "symbol" and node[1].startswith(name + "_"):
+            node = ["symbol", node[1][len(name):]] + node[2:]
+        nodes.append(node)
+    return sexp.digest(nodes)
+
+
+def derive(symbols):
+    """
+    Return `symbols` with any symbol whose body is the same as an earlier
+    symbol's replaced by a derived symbol which extends it, keeping its own
+    properties.
+    """
+    parents = {}
+    result = []
+    for symbol in symbols:
+        parent = parents.setdefault(body(symbol), symbol[1])
+        if parent == symbol[1]:
+            result.append(symbol)
+        else:
+            result.append(["symbol", symbol[1], ["extends", parent]] +
+                          list(sexp.find_all(symbol, "property")))
+    return result
+
+
+def duplicates(lib):
+    """
+    Find subtrees of the parsed library `lib` which appear more than once,
+    other than inside a larger repeated subtree. Returns a list of
+    (bytes, count, path) for each, where `bytes` is the generated size of
+    one copy and `path` is where it first appears, largest total first.
+    """
+    digests = {}
+    sexp.digest(lib, digests)
+    counts = defaultdict(int)
+    for d in digests.values():
+        counts[d] += 1
+
+    found = {}
+
+    def walk(node, depth, path):
+        d = digests[id(node)]
+        if counts[d] > 1:
+            found.setdefault(d, [node, depth, path, 0])[3] += 1
+            return
+        for child in node:
+            if isinstance(child, list):
+                head, ident = sexp_diff.identity(child)
+                label = head if ident is None else "{}[{}]".format(head, ident)
+                walk(child, depth + 1, path + (label,))
+
+    for symbol in lib[1:]:
+        walk(symbol, 1, (str(symbol[1]),))
+
+    result = []
+    for node, depth, path, count in found.values():
+        if count > 1:
+            size = len(sexp.generate(node, depth))
+            result.append((size, count, path))
+    result.sort(key=lambda r: -r[0] * r[1])
+    return result
+
+
+def report(libpath, outpath, limit=20):
+    """Print the repeated subtrees and aliases in the compiled library."""
+    manifest = buildcache.load(cachename(outpath), CACHE_VERSION)
+    current = readlib(outpath)
+    old = current if recorded(current, manifest) else None
+    text = compilelib(libpath, manifest, old=old).decode()
+    lib = sexp.parse(text, parse_nums=True)
+
+    found = duplicates(lib)
+    repeated = sum(size * (count - 1) for size, count, _ in found)
+    print("{} bytes in total, {} bytes in {} repeated subtrees."
+          .format(len(text), repeated, len(found)))
+    print("{:>8} {:>6} {:>8}  first copy".format("bytes", "copies", "total"))
+    for size, count, path in found[:limit]:
+        print("{:>8} {:>6} {:>8}  {}"
+              .format(size, count, size * count, "/".join(path)))
+
+    derived = derive(lib[3:])
+    aliases = [sym for sym in derived if sexp.has(sym, "extends")]
+    saved = len(text) - len(sexp.generate(lib[:3] + derived))
+    print("{} symbols are aliases; writing them with --extends saves {} "
+          "bytes.".format(len(aliases), saved))
+    for sym in aliases:
+        print("  {} extends {}".format(sym[1], sexp.find(sym, "extends")[1]))
 
 
 if __name__ == "__main__":
-    if len(sys.argv) not in (3, 4):
-        usage()
-    else:
-        libpath = sys.argv[1]
-        outpath = sys.argv[2]
-        if len(sys.argv) == 3:
-            writelib(libpath, outpath)
-        elif len(sys.argv) == 4 and sys.argv[3] == "--verify":
-            if checklib(libpath, outpath):
-                print("OK: '{}' is up-to-date with '{}'."
-                      .format(outpath, libpath))
-                sys.exit(0)
-            else:
-                print("Error: '{}' is not up-to-date with '{}'."
-                      .format(outpath, libpath), file=sys.stderr)
-                print("Please run compile_lib.py to regenerate.",
-                      file=sys.stderr)
-                sys.exit(1)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("libpath", type=str, help=
+                        "Path to libraries to compile")
+    parser.add_argument("outpath", type=str, help=
+                        "Path to the compiled library")
+    parser.add_argument("--verify", action="store_true", help=
+                        "Verify the compiled library is up to date")
+    parser.add_argument("--extends", action="store_true", help=
+                        "Write aliases as symbols extending another")
+    parser.add_argument("--duplicates", action="store_true", help=
+                        "List repeated subtrees instead of writing")
+    args = parser.parse_args()
+    if args.duplicates:
+        report(args.libpath, args.outpath)
+    elif args.verify:
+        if checklib(args.libpath, args.outpath, args.extends):
+            print("OK: '{}' is up-to-date with '{}'."
+                  .format(args.outpath, args.libpath))
+            sys.exit(0)
         else:
-            usage()
+            print("Error: '{}' is not up-to-date with '{}'."
+                  .format(args.outpath, args.libpath), file=sys.stderr)
+            print("Please run compile_lib.py to regenerate.",
+                  file=sys.stderr)
+            sys.exit(1)
+    else:
+        writelib(args.libpath, args.outpath, args.extends)
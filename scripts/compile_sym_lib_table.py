@@ -13,6 +13,7 @@ import sys
 import os
 import fnmatch
 import sexp
+import sexp_diff
 
 
 def maketable(libpath):
@@ -32,14 +33,19 @@ def maketable(libpath):
 def writetable(libpath, tblpath):
     tbl = maketable(libpath)
     with open(tblpath, "w") as f:
-        f.write(sexp.generate(tbl))
+        sexp.dump(tbl, f)
 
 
 def checktable(libpath, tblpath):
     tbl = maketable(libpath)
     with open(tblpath, "r") as f:
         old_tbl = sexp.parse(f.read())
-    return tbl == old_tbl
+    if tbl == old_tbl:
+        return True
+    changes = sexp_diff.diff(old_tbl, tbl)
+    for line in sexp_diff.format_changes(changes, limit=20):
+        print(" ", line, file=sys.stderr)
+    return False
 
 
 if __name__ == "__main__":
@@ -0,0 +1,88 @@
+"""
+configs.py
+Copyright 2022 Adam Greig
+Licensed under the MIT licence, see LICENSE file for details.
+
+Load the YAML config files which the builders generate symbols and footprints
+from.
+
+Files are parsed with libyaml's CSafeLoader when PyYAML was built with it,
+which is many times quicker than the pure Python loader. Parsed configs are
+cached in .cache/ with the content hash of each file, so files whose contents
+are unchanged are not parsed again. Every file is still read and hashed, as
+builders use the hash to decide what to skip and a modification time can be
+reset to hide an edit. Files are read and parsed in a thread pool.
+"""
+
+import os
+import fnmatch
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import yaml
+
+import buildcache
+
+
+Loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+# Cached configs are discarded if this script or PyYAML changes.
+CACHE_VERSION = buildcache.script_version(__file__) + yaml.__version__
+
+# One loaded config file: the directory it is in, its path, the hash of its
+# contents and the parsed config.
+Config = namedtuple("Config", "dirpath path hash item")
+
+
+def parse(data):
+    """Parse the YAML document `data`."""
+    return yaml.load(data, Loader=Loader)
+
+
+def find(root):
+    """Yield the directory and path of every YAML file in `root`, in order."""
+    for dirpath, dirnames, files in os.walk(root):
+        dirnames.sort()
+        files.sort()
+        for fn in fnmatch.filter(files, "*.yaml"):
+            yield dirpath, os.path.join(dirpath, fn)
+
+
+def _load(path, entry):
+    """
+    Return the cache entry for the file at `path`, reusing the previous
+    `entry` if the file's contents are unchanged.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    digest = buildcache.hash_bytes(data)
+    if entry is not None and entry["hash"] == digest:
+        return entry
+    return {"hash": digest, "item": parse(data)}
+
+
+def load(root, jobs=None):
+    """
+    Load every YAML file in `root`, returning a list of Configs in the order
+    they are found, sorted by directory and then name. The cache is read
+    afresh on each call, so the configs returned may be modified.
+
+    Uncached files are read and parsed in up to `jobs` threads.
+    """
+    name = buildcache.manifest_name("configs", root)
+    cache = buildcache.load(name, CACHE_VERSION, binary=True)
+    cached = cache.get("files", {})
+
+    found = list(find(root))
+    keys = [os.path.abspath(path) for _, path in found]
+    entries = [cached.get(key) for key in keys]
+    with ThreadPoolExecutor(jobs) as pool:
+        loaded = list(pool.map(_load, [path for _, path in found], entries))
+
+    changed = any(new is not old for new, old in zip(loaded, entries))
+    if changed or len(cached) != len(keys):
+        cache["files"] = dict(zip(keys, loaded))
+        buildcache.save(name, cache, binary=True)
+
+    return [Config(dirpath, path, entry["hash"], entry["item"])
+            for (dirpath, path), entry in zip(found, loaded)]
@@ -0,0 +1,148 @@
+"""
+geometry.py
+Copyright 2022 Adam Greig
+Licensed under the MIT licence, see LICENSE file for details.
+
+Exact arithmetic on KiCad coordinates as integer nanometres.
+
+KiCad stores every length internally as a whole number of nanometres, so
+converting the millimetre strings in its files to integers once lets grid
+checks, width comparisons and translations be done with integer arithmetic,
+without building Decimal objects for each value. Lengths are written back out
+with as many decimal places as they were read with, so unchanged values keep
+their original text.
+
+The rare values which are not a whole number of nanometres, or which are
+written with an exponent, fall back to Decimal so that they stay exact.
+"""
+
+import functools
+from decimal import Decimal, InvalidOperation
+
+
+# Nanometres per millimetre.
+MM = 1000000
+
+# Decimal places in a millimetre value which are whole nanometres.
+PLACES = 6
+
+
+@functools.lru_cache(maxsize=65536)
+def to_nm(mm):
+    """
+    Convert the millimetre value `mm`, a string or number as found in a
+    parsed file, to integer nanometres. Values which are not a whole number
+    of nanometres are returned exactly as a Decimal number of nanometres.
+
+    The same few values appear over and over in KiCad files, so conversions
+    are cached.
+    """
+    text = mm if isinstance(mm, str) else str(mm)
+    whole, _, frac = text.partition(".")
+    # Values without any digits, such as "" or "-.", are left for Decimal to
+    # reject, rather than being read as 0.
+    if (frac.isdigit() or not frac) and (frac or whole.lstrip("+-").isdigit()):
+        frac = frac.rstrip("0")
+        if len(frac) <= PLACES:
+            try:
+                # Shifting the decimal point six places gives nanometres
+                return int(whole + frac.ljust(PLACES, "0"))
+            except ValueError:
+                pass
+    try:
+        nm = Decimal(text).scaleb(PLACES)
+    except InvalidOperation:
+        raise ValueError("Invalid length {!r}".format(mm)) from None
+    if not nm.is_finite():
+        raise ValueError("Invalid length {!r}".format(mm))
+    if nm == nm.to_integral_value():
+        return int(nm)
+    return nm
+
+
+def places(mm):
+    """Return the number of decimal places written in the value `mm`."""
+    text = mm if isinstance(mm, str) else str(mm)
+    if "e" in text or "E" in text:
+        return max(0, -Decimal(text).as_tuple().exponent)
+    whole, point, frac = text.partition(".")
+    return len(frac)
+
+
+def to_mm(nm, places=PLACES):
+    """
+    Return the nanometres `nm`, an integer or Decimal, as a millimetre string
+    with exactly `places` decimal places.
+    """
+    if not isinstance(nm, int):
+        mm = nm.scaleb(-PLACES)
+        rounded = mm.quantize(Decimal(1).scaleb(-max(places, 0)))
+        if rounded != mm:
+            raise ValueError("{}nm needs more than {} decimal places"
+                             .format(nm, places))
+        return "{:f}".format(rounded)
+    sign = "-" if nm < 0 else ""
+    whole, frac = divmod(abs(nm), MM)
+    frac = str(frac).rjust(PLACES, "0")
+    if places <= 0:
+        if int(frac):
+            raise ValueError("{}nm needs more than {} decimal places"
+                             .format(nm, places))
+        return "{}{}".format(sign, whole)
+    if places < PLACES and int(frac[places:]):
+        raise ValueError("{}nm needs more than {} decimal places"
+                         .format(nm, places))
+    frac = frac[:places].ljust(places, "0")
+    return "{}{}.{}".format(sign, whole, frac)
+
+
+class Length(int):
+    """
+    A length in integer nanometres, which is written out in millimetres with
+    `places` decimal places, such as by sexp.generate.
+    """
+
+    def __new__(cls, nm, places=PLACES):
+        length = super().__new__(cls, nm)
+        length.places = places
+        return length
+
+    @classmethod
+    def parse(cls, mm):
+        """Return the millimetre value `mm` as a Length with its precision."""
+        return cls(to_nm(mm), places(mm))
+
+    def __str__(self):
+        return to_mm(self, self.places)
+
+    def __repr__(self):
+        return "Length({!r})".format(str(self))
+
+
+def length(nm, places=PLACES):
+    """
+    Return the nanometres `nm` as a Length, or as Decimal millimetres with
+    `places` decimal places if it is not a whole number of nanometres.
+    """
+    if isinstance(nm, int):
+        return Length(nm, places)
+    return Decimal(to_mm(nm, places))
+
+
+def on_grid(values, grid):
+    """
+    Return True if every millimetre value in `values` is a whole multiple of
+    `grid` nanometres.
+    """
+    return all(to_nm(v) % grid == 0 for v in values)
+
+
+def translate(values, offsets, offset_places=0):
+    """
+    Return the millimetre values `values` each moved by the matching
+    nanometre offset in `offsets`, as given by `length`. Each result has as
+    many decimal places as the larger of its original value and
+    `offset_places`, as adding them as Decimals would give.
+    """
+    return [length(to_nm(v) + d, max(places(v), offset_places))
+            for v, d in zip(values, offsets)]
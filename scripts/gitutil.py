@@ -0,0 +1,72 @@
+"""
+gitutil.py
+Copyright 2022 Adam Greig
+Licensed under the MIT licence, see LICENSE file for details.
+
+Find which files git reports as changed, so that builders and checkers can
+limit their work to those files.
+"""
+
+import os
+import functools
+import subprocess
+
+
+@functools.lru_cache()
+def toplevel():
+    """Return the absolute path of the top of the current git work tree."""
+    out = subprocess.run(["git", "rev-parse", "--show-toplevel"],
+                         stdout=subprocess.PIPE, check=True)
+    return out.stdout.decode().strip()
+
+
+def changed_files(since=None):
+    """
+    Return the set of absolute paths of files staged in the index, which are
+    about to be committed. If `since` is given, instead return those in the
+    work tree which differ from the revision `since`, including any new
+    untracked files.
+    """
+    top = toplevel()
+    if since is None:
+        names = _names(["git", "diff", "--cached", "--name-only", "-z"])
+    else:
+        names = _names(["git", "diff", "--name-only", "-z", since, "--"])
+        names += _names(["git", "ls-files", "--others", "--exclude-standard",
+                         "--full-name", "-z", top])
+    return {os.path.normpath(os.path.join(top, name)) for name in names}
+
+
+def selection(staged=False, paths=None):
+    """
+    Return the set of absolute paths chosen by the --staged and --paths
+    options of a script, or None to select every file.
+
+    Every output depends on the scripts which generate and check it, so if
+    any script is staged, every file is selected.
+    """
+    if not staged and paths is None:
+        return None
+    selected = set()
+    if staged:
+        staged = changed_files()
+        scripts = os.path.join(toplevel(), "scripts") + os.sep
+        if any(path.startswith(scripts) for path in staged):
+            return None
+        selected |= staged
+    if paths is not None:
+        selected |= {os.path.abspath(path) for path in paths}
+    return selected
+
+
+def selected(selection, *paths):
+    """Check whether any of `paths` are in `selection`, or it is None."""
+    if selection is None:
+        return True
+    return any(os.path.abspath(path) in selection for path in paths)
+
+
+def _names(args):
+    """Run the git command `args` and return the NUL separated names."""
+    out = subprocess.run(args, stdout=subprocess.PIPE, check=True)
+    return [name for name in out.stdout.decode().split("\0") if name]
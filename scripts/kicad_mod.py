@@ -8,6 +8,8 @@ Helper functions for generating KiCAD footprint files.
 
 from __future__ import print_function, division
 
+import sexp
+
 CTYD_GAP = 0.25
 CTYD_GRID = 0.05
 CTYD_WIDTH = 0.01
@@ -76,6 +78,26 @@ def pad(num, padtype, shape, at, size, layers, drill=None, offset=None,
     return pad
 
 
+def pad_block(pads, padtype, shape, size, layers, depth=1, **kwargs):
+    """
+    Return the text of many pads which differ only in number and position,
+    exactly as `sexp.generate` would write each of them `depth` deep, for
+    inserting into a generated footprint.
+
+    `pads` is a list of (num, x, y), and the other arguments are as for `pad`.
+    The text of one pad is generated once and used as a template for the
+    rest, which is much quicker than generating each pad separately.
+    """
+    text = sexp.generate(pad("PADNUM", padtype, shape, ("PADX", "PADY"),
+                             size, layers, **kwargs), depth)
+    template = (text.replace("{", "{{").replace("}", "}}")
+                .replace("PADNUM", "{0}").replace("PADX", "{1}")
+                .replace("PADY", "{2}"))
+    atom = sexp.atom
+    return "".join(template.format(atom(num), atom(x), atom(y))
+                   for num, x, y in pads)
+
+
 def draw_square(width, height, centre, layer, thickness):
     """Draw a square of (`width`, `height`) centered on `centre`."""
     out = []
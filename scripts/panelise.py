@@ -10,49 +10,53 @@ from __future__ import print_function, division
 import sys
 import copy
 import datetime
-from decimal import Decimal
 
-from sexp import parse as sexp_parse, generate as sexp_generate
+import geometry
+from sexp import parse_file as sexp_parse_file, dump as sexp_dump
 
 
 def simples(n, out, xr, xp, yr, yp):
     for x in range(xr):
         for y in range(yr):
-            xx = x * xp
-            yy = y * yp
-            simple(n, out, xx, yy)
+            xx = x * geometry.to_nm(xp)
+            yy = y * geometry.to_nm(yp)
+            simple(n, out, xx, yy, geometry.places(xp), geometry.places(yp))
 
 
-def simple(n, out, x, y):
+def simple(n, out, x, y, xplaces, yplaces):
     new = copy.deepcopy(n)
-    for idx, child in enumerate(new):
-        if child[0] in ("at", "start", "end"):
-            new[idx][1] = Decimal(child[1]) + x
-            new[idx][2] = Decimal(child[2]) + y
+    pts = [child for child in new if child[0] in ("at", "start", "end")]
+    xs = geometry.translate([p[1] for p in pts], [x] * len(pts), xplaces)
+    ys = geometry.translate([p[2] for p in pts], [y] * len(pts), yplaces)
+    for p, xx, yy in zip(pts, xs, ys):
+        p[1:3] = [xx, yy]
     out.append(new)
 
 
 def zones(n, out, xr, xp, yr, yp):
     for x in range(xr):
         for y in range(yr):
-            xx = x * xp
-            yy = y * yp
-            zone(n, out, xx, yy)
+            xx = x * geometry.to_nm(xp)
+            yy = y * geometry.to_nm(yp)
+            zone(n, out, xx, yy, geometry.places(xp), geometry.places(yp))
 
 
-def zone(n, out, x, y):
+def zone(n, out, x, y, xplaces, yplaces):
     new = copy.deepcopy(n)
     for idx, child in enumerate(new):
         if child[0] in ("polygon", "filled_polygon"):
-            new[idx][1] = ["pts"]
-            for (xy, xx, yy) in n[idx][1][1:]:
-                new[idx][1].append([xy, Decimal(xx)+x, Decimal(yy)+y])
+            pts = n[idx][1][1:]
+            xs = geometry.translate([p[1] for p in pts], [x] * len(pts),
+                                    xplaces)
+            ys = geometry.translate([p[2] for p in pts], [y] * len(pts),
+                                    yplaces)
+            new[idx][1] = ["pts"] + [[p[0], xx, yy]
+                                     for p, xx, yy in zip(pts, xs, ys)]
     out.append(new)
 
 
 def main(inpath, outpath, xr, xp, yr, yp):
-    with open(inpath) as f:
-        insexp = sexp_parse(f.read())
+    insexp = sexp_parse_file(inpath)
 
     outsexp = [
         "kicad_pcb",
@@ -71,16 +75,16 @@ def main(inpath, outpath, xr, xp, yr, yp):
             zones(node, outsexp, xr, xp, yr, yp)
 
     with open(outpath, "w") as f:
-        f.write(sexp_generate(outsexp))
+        sexp_dump(outsexp, f)
 
 
 if __name__ == "__main__":
     if len(sys.argv) == 7:
         inpath = sys.argv[1]
         x_repeat = int(sys.argv[2])
-        x_pitch = Decimal(sys.argv[3])
+        x_pitch = sys.argv[3]
         y_repeat = int(sys.argv[4])
-        y_pitch = Decimal(sys.argv[5])
+        y_pitch = sys.argv[5]
         outpath = sys.argv[6]
         main(inpath, outpath, x_repeat, x_pitch, y_repeat, y_pitch)
     else:
@@ -0,0 +1,45 @@
+"""
+parallel.py
+Copyright 2022 Adam Greig
+Licensed under the MIT licence, see LICENSE file for details.
+
+Run independent pieces of work across a pool of processes, collecting the
+results in their original order so output matches a serial run.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+
+def default_jobs():
+    """Return the default number of processes, one per CPU."""
+    return os.cpu_count() or 1
+
+
+def imap(fn, items, jobs=None):
+    """
+    Yield `fn(item)` for each of `items`, in order, using up to `jobs`
+    processes (by default one per CPU). With a single job everything runs in
+    this process instead.
+
+    `fn` and every item must be picklable, so `fn` must be defined at module
+    level. Any exception raised by `fn` is raised again here when its result
+    is reached, and work not yet started is cancelled if this generator is
+    closed early.
+    """
+    items = list(items)
+    if jobs is None:
+        jobs = default_jobs()
+    jobs = min(jobs, len(items))
+    if jobs <= 1:
+        yield from map(fn, items)
+        return
+
+    executor = ProcessPoolExecutor(jobs)
+    try:
+        # Send several items to each worker at once to save on round trips,
+        # while still leaving enough chunks to balance uneven work.
+        chunksize = max(1, len(items) // (jobs * 4))
+        yield from executor.map(fn, items, chunksize=chunksize)
+    finally:
+        executor.shutdown(cancel_futures=True)
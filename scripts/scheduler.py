@@ -0,0 +1,180 @@
+"""
+scheduler.py
+Copyright 2022 Adam Greig
+Licensed under the MIT licence, see LICENSE file for details.
+
+Run a graph of build stages. Each stage starts as soon as the stages it
+follows have finished, independent stages run at the same time in separate
+processes, and stages whose inputs and outputs are unchanged since they last
+succeeded are skipped. Files are compared by the hash of their contents, as
+modification times can be kept or restored while the contents change.
+
+A stage is any object with these attributes:
+    name:    unique name of the stage
+    after:   names of stages which must finish first, when also being run
+    inputs:  glob patterns for the files the stage reads
+    outputs: glob patterns for the files the stage writes
+    extra:   function returning any other input the stage depends on as a
+             string, such as the git version it writes out, or None
+"""
+
+import io
+import sys
+import glob
+import time
+import hashlib
+import contextlib
+
+import buildcache
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+
+def fingerprint(patterns, extra=""):
+    """
+    Return a hash of the path and contents of every file matching the glob
+    `patterns`, and of the string `extra`.
+    """
+    paths = set()
+    for pattern in patterns:
+        paths.update(glob.glob(pattern, recursive=True))
+    h = hashlib.sha256(extra.encode())
+    for path in sorted(paths):
+        h.update("\0{}\0{}\n".format(
+            path, buildcache.hash_file(path)).encode())
+    return h.hexdigest()
+
+
+def stage_inputs(stage):
+    """Return the fingerprint of everything `stage` reads."""
+    extra = stage.extra() if stage.extra is not None else ""
+    return fingerprint(stage.inputs, extra)
+
+
+def _call(runner, name):
+    """
+    Run `runner(name)` in a worker process, returning its result and anything
+    it printed, so each stage's output can be printed together.
+    """
+    out, err = io.StringIO(), io.StringIO()
+    with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+        result = runner(name)
+    return result, out.getvalue(), err.getvalue()
+
+
+def critical_path(stages, durations):
+    """
+    Return the chain of stages, each following the one before, with the
+    longest total duration. However many stages run in parallel, the build
+    cannot finish any faster than this. `durations` gives the time taken by
+    each stage which ran, in the order they finished.
+    """
+    length = {}
+    previous = {}
+    for name, duration in durations.items():
+        before = [dep for dep in stages[name].after
+                  if dep != name and dep in length]
+        previous[name] = max(before, key=length.get, default=None)
+        length[name] = duration + length.get(previous[name], 0.0)
+
+    name = max(length, key=length.get)
+    path = []
+    while name is not None:
+        path.append(name)
+        name = previous[name]
+    return path[::-1]
+
+
+def schedule(stages, names, runner, jobs=1, manifest=None, force=False):
+    """
+    Run the stages `names`, looked up in the dict `stages`, by calling
+    `runner(name)` for each, which returns False if the stage failed.
+
+    Up to `jobs` stages run at once, each in its own process; with a single
+    job, stages run one after another in this process. `runner` must then be
+    picklable, so defined at module level.
+
+    `manifest` records the input and output fingerprints of each stage which
+    succeeds, and unless `force` is set, stages are skipped if both still
+    match. No new stages are started after one fails.
+
+    Prints each stage's time as it finishes and a report of the critical
+    path at the end, and returns True if every stage succeeded.
+    """
+    if manifest is None:
+        manifest = {}
+    recorded = manifest.setdefault("stages", {})
+
+    pending = list(names)
+    running = {}
+    started = {}
+    finished = {}
+    ok = True
+
+    def finish(name, inputs, result):
+        nonlocal ok
+        finished[name] = time.perf_counter()
+        elapsed = finished[name] - started[name]
+        if result is False:
+            ok = False
+            recorded.pop(name, None)
+            print("{:<24} {:7.2f}s  FAILED".format(name, elapsed),
+                  file=sys.stderr)
+        else:
+            recorded[name] = {"inputs": inputs,
+                              "outputs": fingerprint(stages[name].outputs)}
+            print("{:<24} {:7.2f}s".format(name, elapsed))
+
+    executor = ProcessPoolExecutor(jobs) if jobs > 1 else None
+    start = time.perf_counter()
+    try:
+        while pending or running:
+            # Start every stage which is no longer waiting for another stage
+            waiting = set(pending) | {name for name, _ in running.values()}
+            for name in list(pending) if ok else []:
+                stage = stages[name]
+                if any(dep in waiting for dep in stage.after if dep != name):
+                    continue
+                pending.remove(name)
+                started[name] = time.perf_counter()
+                inputs = stage_inputs(stage)
+                last = recorded.get(name)
+                if (not force and last is not None
+                        and last["inputs"] == inputs
+                        and last["outputs"] == fingerprint(stage.outputs)):
+                    finished[name] = started[name]
+                    print("{:<24} {:>8}".format(name, "skipped"))
+                elif executor is None:
+                    finish(name, inputs, runner(name))
+                    break
+                else:
+                    future = executor.submit(_call, runner, name)
+                    running[future] = (name, inputs)
+
+            if not ok:
+                pending = []
+            if not running:
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name, inputs = running.pop(future)
+                result, out, err = future.result()
+                sys.stdout.write(out)
+                sys.stderr.write(err)
+                finish(name, inputs, result)
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    total = time.perf_counter() - start
+    durations = {name: finished[name] - started[name] for name in finished
+                 if finished[name] > started[name]}
+    if durations:
+        path = critical_path(stages, durations)
+        length = sum(durations[name] for name in path)
+        print("Critical path: {:.2f}s of {:.2f}s total".format(length, total))
+        for name in path:
+            print("  {:<22} {:7.2f}s".format(name, durations[name]))
+    else:
+        print("Nothing to do: all stages up-to-date.")
+    return ok
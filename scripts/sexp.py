@@ -6,77 +6,547 @@ Licensed under the MIT licence, see LICENSE file for details.
 S-Expression parser/emitter
 """
 
+import io
 import re
+import mmap
+import hashlib
+import sys
 from decimal import Decimal
 
 
-def parse(sexp, parse_nums=False):
+# Master token pattern for the parser. Leading whitespace is skipped and each
+# match is classified by the name of the group which matched it.
+# A double quote inside a string only terminates it when not preceded by a
+# backslash; escapes are otherwise left as they are in the input.
+_TOKEN = re.compile(r"""
+    \s*(?:
+        (?P<open>\()
+      | (?P<close>\))
+      | "(?P<string>[^"]*(?:(?<=\\)"[^"]*)*)(?<!\\)"
+      | (?P<int>[+-]?[0-9]+)(?=[\s()]|$)
+      | (?P<float>[+-]?[0-9]+\.[0-9]*)(?=[\s()]|$)
+      | (?P<symbol>[^\s()"]+)
+    )""", re.VERBOSE)
+
+# The same pattern for tokenising bytes, such as a memory-mapped file.
+_TOKEN_BYTES = re.compile(_TOKEN.pattern.encode(), re.VERBOSE)
+
+
+class Index:
+    """
+    Children of a parsed list indexed by name, so that find, find_all and has
+    are dictionary lookups instead of scans over every child.
+
+    The index is built once, so must not be used after `node` is modified.
+    """
+
+    def __init__(self, node, positions=None):
+        self.node = node
+        if positions is not None:
+            self.positions = positions
+            return
+        self.positions = {}
+        for idx, child in enumerate(node):
+            if (isinstance(child, (list, tuple)) and child
+                    and isinstance(child[0], str)):
+                self.positions.setdefault(child[0], []).append(idx)
+
+    def find(self, *names):
+        """Return the first child whose name is in `names`."""
+        found = [self.positions[name][0] for name in names
+                 if name in self.positions]
+        if found:
+            return self.node[min(found)]
+
+    def find_all(self, *names):
+        """Yield all children whose name is in `names`, in order."""
+        found = [idx for name in names for idx in self.positions.get(name, ())]
+        if len(names) > 1:
+            found.sort()
+        for idx in found:
+            yield self.node[idx]
+
+    def has(self, *names):
+        """Return True if any child has a name in `names`."""
+        return any(name in self.positions for name in names)
+
+
+# Nodes with more children than this build an Index on their first lookup.
+# Scanning fewer children is quicker than building an Index for them, and
+# most nodes, such as (at x y) or (font (size 1 1)), have only a few.
+INDEX_MIN = 16
+
+
+class Node(tuple):
+    """
+    A compact parsed list, as returned by `parse` with `compact=True`.
+
+    Holds the list's name followed by its children, like the list it replaces,
+    but uses less memory and cannot be modified. Nodes with many children,
+    such as a whole symbol or footprint, build an `Index` on first lookup and
+    keep it, so repeated lookups by name are cheap.
+    """
+
+    def name_index(self):
+        """Return the cached `Index` of this node's children."""
+        try:
+            return self._index
+        except AttributeError:
+            self._index = Index(self)
+            return self._index
+
+    def find(self, *names):
+        """Return the first child whose name is in `names`."""
+        if len(self) > INDEX_MIN:
+            return self.name_index().find(*names)
+        for child in self:
+            if type(child) is Node and child and child[0] in names:
+                return child
+
+    def find_all(self, *names):
+        """Yield all children whose name is in `names`, in order."""
+        if len(self) > INDEX_MIN:
+            return self.name_index().find_all(*names)
+        return (child for child in self
+                if type(child) is Node and child and child[0] in names)
+
+    def has(self, *names):
+        """Return True if any child has a name in `names`."""
+        return self.find(*names) is not None
+
+
+def _node(items):
+    """Convert a parsed list into a Node, interning its name."""
+    if items and isinstance(items[0], str):
+        items[0] = sys.intern(items[0])
+    return Node(items)
+
+
+def parse(sexp, parse_nums=False, compact=False, lazy=False, heads=None):
     """
     Parse an S-expression into Python lists.
+
+    Quoted strings are returned with surrounding whitespace stripped, and
+    with `parse_nums` any unquoted integers or decimals are returned as
+    `int` or `float`. With `compact`, every list is returned as a `Node`
+    instead.
+
+    With `lazy`, returns a `LazyNode` whose child lists are only parsed when
+    accessed, and if `heads` is given only children with those names are kept.
     """
-    r = [[]]
-    token = None
-    quote = False
-    quoted = False
-    empty_string = object()
-    for c in sexp:
-        if c == '(' and not quote:
-            r.append([])
-        elif c in (')', ' ', '\n') and not quote:
-            if token is not None and (token == empty_string or token.strip() != ""):
-                if token == empty_string:
-                    token = ""
-                else:
-                    token = token.strip()
-                if parse_nums and not quoted:
-                    if re.match("^[\+\-]?[0-9]+$", token):
-                        token = int(token)
-                    elif re.match("^[\+\-]?[0-9]+\.?[0-9]*$", token):
-                        try:
-                            token = float(token)
-                        except ValueError:
-                            pass
-                r[-1].append(token)
-            token = None
-            quoted = False
-            if c == ')':
-                t = r.pop()
-                r[-1].append(t)
-        elif c == '"' and (token is None or token[-1] != '\\'):
-            quote = not quote
-            if token and not quote:
-                quoted = True
-            if not token and not quote:
-                token = empty_string
+    if lazy:
+        return LazyNode(sexp, parse_nums, compact, heads)
+    return _parse(sexp, parse_nums, compact, 0, len(sexp))
+
+
+def parse_file(path, parse_nums=False, compact=False, lazy=False,
+               heads=None):
+    """
+    Parse the S-expression in the file at `path`, as `parse`.
+
+    If `lazy`, the file is memory-mapped and tokenised as bytes rather than
+    read and decoded as a whole, and only the atoms returned are decoded. A
+    LazyNode keeps the file mapped for as long as it exists. Otherwise the
+    whole file is read, which is quicker when every node is wanted anyway.
+    """
+    if not lazy:
+        with open(path, encoding="utf-8") as f:
+            return parse(f.read(), parse_nums, compact)
+    with open(path, "rb") as f:
+        try:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files cannot be mapped
+            buf = b""
+    return LazyNode(buf, parse_nums, compact, heads)
+
+
+def _parse(sexp, parse_nums, compact, pos, endpos):
+    """
+    Parse the first list found in `sexp` between `pos` and `endpos`.
+    `sexp` may be a str or a bytes-like object, whose atoms are decoded.
+    """
+    binary = not isinstance(sexp, str)
+    token_re = _TOKEN_BYTES if binary else _TOKEN
+    root = []
+    stack = [root]
+    parent = root
+    for m in token_re.finditer(sexp, pos, endpos):
+        kind = m.lastgroup
+        if kind == 'open':
+            node = []
+            parent.append(node)
+            stack.append(node)
+            parent = node
+        elif kind == 'close':
+            stack.pop()
+            parent = stack[-1]
+            if compact:
+                parent[-1] = _node(parent[-1])
+        elif kind == 'string':
+            token = m.group('string')
+            if binary:
+                token = token.decode()
+            if token:
+                token = token.strip()
+                if not token:
+                    continue
+            parent.append(token)
+        elif kind == 'int' and parse_nums:
+            parent.append(int(m.group('int')))
+        elif kind == 'float' and parse_nums:
+            parent.append(float(m.group('float')))
+        elif binary:
+            parent.append(m.group(kind).decode())
         else:
-            if token is None:
-                token = ''
-            token += c
-    return r[0][0]
+            parent.append(m.group(kind))
+    return root[0]
 
 
-def generate(sexp, depth=0):
-    """Turn a list of lists into an s-expression."""
-    single_word = re.compile("^-?[a-zA-Z_*\.]+$")
-    parts = []
+def _atom(m, parse_nums):
+    """Convert a non-bracket token match into its value."""
+    kind = m.lastgroup
+    if kind == 'int' and parse_nums:
+        return int(m.group('int'))
+    elif kind == 'float' and parse_nums:
+        return float(m.group('float'))
+    token = m.group(kind)
+    if not isinstance(token, str):
+        token = token.decode()
+    if kind == 'string' and token:
+        token = token.strip()
+        if not token:
+            return None
+    return token
+
+
+# A quoted string, as matched by _TOKEN.
+_STRING = r'"[^"]*(?:(?<=\\)"[^"]*)*(?<!\\)"'
+
+
+def _nested(depth):
+    """
+    Build a pattern matching one complete list, including any quoted strings
+    and any lists nested up to `depth` deep inside it.
+    """
+    pattern = r'\([^()"]*(?:' + _STRING + r'[^()"]*)*\)'
+    for _ in range(depth):
+        pattern = (r'\([^()"]*(?:(?:' + _STRING + '|' + pattern +
+                   r')[^()"]*)*\)')
+    return pattern
+
+
+# Matches a whole list in a single step, provided it is nested no more deeply
+# than KiCad files are; deeper lists are found by counting brackets instead.
+_LIST = re.compile(_nested(12))
+_BRACKETS = re.compile(r'(?P<open>\()|(?P<close>\))|' + _STRING)
+_LIST_BYTES = re.compile(_LIST.pattern.encode())
+_BRACKETS_BYTES = re.compile(_BRACKETS.pattern.encode())
+
+
+def _list_end(sexp, pos, endpos):
+    """Return the index just after the end of the list starting at `pos`."""
+    binary = not isinstance(sexp, str)
+    m = (_LIST_BYTES if binary else _LIST).match(sexp, pos, endpos)
+    if m is not None:
+        return m.end()
+    depth = 0
+    for m in (_BRACKETS_BYTES if binary else _BRACKETS).finditer(
+            sexp, pos, endpos):
+        if m.lastgroup == 'open':
+            depth += 1
+        elif m.lastgroup == 'close':
+            depth -= 1
+            if depth == 0:
+                return m.end()
+    return endpos
+
+
+class LazyNode:
+    """
+    A parsed list whose child lists are only parsed when first accessed, as
+    returned by `parse` with `lazy=True`.
+
+    Creating it only finds where each child list starts and ends and what its
+    name is, so finding children by name never parses the others. If `heads`
+    is given, only child lists with those names are kept at all.
+    `sexp` may be a str or a bytes-like object, which is kept until every
+    child has been parsed.
+    """
+
+    def __init__(self, sexp, parse_nums=False, compact=False, heads=None):
+        self.sexp = sexp
+        self.parse_nums = parse_nums
+        self.compact = compact
+        self.items = []
+        self.spans = []
+        self.positions = {}
+
+        token_re = _TOKEN if isinstance(sexp, str) else _TOKEN_BYTES
+        endpos = len(sexp)
+        pos = 0
+        # Skip to just inside the opening bracket of the first list
+        for m in token_re.finditer(sexp):
+            if m.lastgroup == 'open':
+                pos = m.end()
+                break
+
+        while True:
+            m = token_re.match(sexp, pos, endpos)
+            if m is None or m.lastgroup == 'close':
+                break
+            if m.lastgroup == 'open':
+                start = m.start('open')
+                pos = _list_end(sexp, start, endpos)
+                name = None
+                first = token_re.match(sexp, start + 1, pos)
+                if first is not None and first.lastgroup not in (
+                        'open', 'close'):
+                    name = _atom(first, parse_nums)
+                if heads is not None and name not in heads:
+                    continue
+                if isinstance(name, str):
+                    self.positions.setdefault(name, []).append(len(self.items))
+                self.items.append(None)
+                self.spans.append((start, pos))
+            else:
+                pos = m.end()
+                token = _atom(m, parse_nums)
+                if token is not None:
+                    self.items.append(token)
+                    self.spans.append(None)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self.items)))]
+        span = self.spans[idx]
+        if span is not None:
+            start, end = span
+            self.items[idx] = _parse(self.sexp, self.parse_nums, self.compact,
+                                     start, end)
+            self.spans[idx] = None
+        return self.items[idx]
+
+    def __iter__(self):
+        for idx in range(len(self.items)):
+            yield self[idx]
+
+    def name_index(self):
+        """Return an `Index` of the children, without parsing any of them."""
+        return Index(self, self.positions)
+
+    def find(self, *names):
+        """Return the first child whose name is in `names`."""
+        return self.name_index().find(*names)
+
+    def find_all(self, *names):
+        """Yield all children whose name is in `names`, in order."""
+        return self.name_index().find_all(*names)
+
+    def has(self, *names):
+        """Return True if any child has a name in `names`."""
+        return self.name_index().has(*names)
+
+
+def iterparse(fileobj, parse_nums=False, chunk_size=65536):
+    """
+    Incrementally parse an S-expression read from `fileobj`.
+
+    Reads `chunk_size` characters at a time and yields (event, node) pairs:
+    ("start", list) when a list is opened, ("atom", value) for each atom, and
+    ("end", list) once a list is complete. Each list is already appended to
+    its parent when started, so callers may remove children they are finished
+    with to keep memory bounded.
+    """
+    stack = []
+    buf = ""
+    pos = 0
+    eof = False
+    while True:
+        if not eof:
+            chunk = fileobj.read(chunk_size)
+            eof = not chunk
+            buf = buf[pos:] + chunk
+            pos = 0
+        end = len(buf)
+        while pos < end:
+            m = _TOKEN.match(buf, pos)
+            if m is None or (m.end() == end and not eof):
+                # Token may continue in the next chunk, or is malformed
+                # and should be skipped once the input is exhausted.
+                if eof:
+                    pos += 1
+                    continue
+                break
+            pos = m.end()
+            kind = m.lastgroup
+            if kind == 'open':
+                node = []
+                if stack:
+                    stack[-1].append(node)
+                stack.append(node)
+                yield "start", node
+            elif kind == 'close':
+                if stack:
+                    yield "end", stack.pop()
+            else:
+                token = _atom(m, parse_nums)
+                if token is not None:
+                    if stack:
+                        stack[-1].append(token)
+                    yield "atom", token
+        if eof:
+            return
+
+
+def iterchildren(fileobj, parse_nums=False, chunk_size=65536):
+    """
+    Incrementally parse the S-expression in `fileobj`, yielding each child of
+    the root node in turn (everything after its name) once it is complete.
+
+    Children are not retained once yielded, so only one is held in memory.
+    """
+    depth = 0
+    root = None
+    named = False
+    for event, node in iterparse(fileobj, parse_nums, chunk_size):
+        if event == "start":
+            if root is None:
+                root = node
+            depth += 1
+        elif event == "end":
+            depth -= 1
+            if depth == 1:
+                root.pop()
+                yield node
+        elif depth == 1:
+            root.pop()
+            if named:
+                yield node
+            named = True
+
+
+# Atoms matching this are written without quotes (other than a list's name).
+_SINGLE_WORD = re.compile(r"^-?[a-zA-Z_*\.]+$")
+
+# Line boundaries as recognised by str.splitlines.
+_LINEBREAK = re.compile("\r\n|[\n\r\v\f\x1c\x1d\x1e\x85\u2028\u2029]")
+
+
+def atom(node):
+    """
+    Return the text written by `dump` for the atom `node`, when it is not the
+    name of a list.
+    """
+    if isinstance(node, str):
+        if _SINGLE_WORD.match(node):
+            return node
+        return "\"{}\"".format(node)
+    elif isinstance(node, (int, Decimal)):
+        return str(node)
+    elif isinstance(node, float):
+        return "{:.4f}".format(node)
+    raise TypeError("Cannot generate s-expression from {!r}".format(node))
+
+
+def dump(sexp, fp, depth=0):
+    """
+    Write a list of lists to the file object `fp` as an s-expression.
+
+    Each nested list starts on a new line indented by two spaces per level,
+    and trailing whitespace is removed from every line.
+    """
+    line = []
+    _dump(sexp, fp, depth, line)
+    fp.write("".join(line).rstrip())
+
+
+def _dump(sexp, fp, depth, line):
+    """
+    Write `sexp` to `fp`, where `line` holds the pieces of the current
+    output line which are written out once it is complete.
+    """
+    fp.write("".join(line).rstrip() + "\n")
+    line[:] = ["  "*depth, "("]
     for idx, node in enumerate(sexp):
-        if isinstance(node, str) and idx > 0 and not single_word.match(node):
-            node.replace("\"", "\\\"")
-            node.replace("\n", "\\n")
-            node = "\"{}\"".format(node)
-        if isinstance(node, (int, Decimal)):
+        if idx > 0:
+            line.append(" ")
+        if isinstance(node, str):
+            if idx > 0 and not _SINGLE_WORD.match(node):
+                node = "\"{}\"".format(node)
+        elif isinstance(node, (int, Decimal)):
             node = str(node)
-        if isinstance(node, float):
+        elif isinstance(node, float):
             node = "{:.4f}".format(node)
-        if isinstance(node, (list, tuple)):
-            node = generate(node, depth+1)
-        parts.append(node)
-    out = "\n{}({})".format(" "*depth*2, " ".join(parts)).splitlines()
-    return "\n".join(l.rstrip() for l in out)
+        elif isinstance(node, (list, tuple)):
+            _dump(node, fp, depth+1, line)
+            continue
+        else:
+            raise TypeError("Cannot generate s-expression from {!r}"
+                            .format(node))
+        if _LINEBREAK.search(node):
+            first, *rest = _LINEBREAK.split(node)
+            line.append(first)
+            for part in rest:
+                fp.write("".join(line).rstrip() + "\n")
+                line[:] = [part]
+        else:
+            line.append(node)
+    line.append(")")
+
+
+def generate(sexp, depth=0):
+    """Turn a list of lists into an s-expression."""
+    out = io.StringIO()
+    dump(sexp, out, depth)
+    return out.getvalue()
+
+
+def digest(sexp, memo=None):
+    """
+    Return a hash of `sexp` made from the hashes of its children, so that
+    subtrees which would generate the same text have the same digest wherever
+    they occur. If `memo` is a dict, the digest of every list in the tree is
+    also stored in it, keyed by the list's id.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    for node in sexp:
+        if isinstance(node, (list, tuple, LazyNode)):
+            h.update(b"(" + digest(node, memo))
+            continue
+        if isinstance(node, str):
+            text = b"s" + node.encode()
+        elif isinstance(node, (int, Decimal)):
+            text = b"n" + str(node).encode()
+        elif isinstance(node, float):
+            text = b"n" + "{:.4f}".format(node).encode()
+        else:
+            raise TypeError("Cannot hash s-expression {!r}".format(node))
+        h.update(len(text).to_bytes(4, "little") + text)
+    result = h.digest()
+    if memo is not None:
+        memo[id(sexp)] = result
+    return result
+
+
+def index(sexp):
+    """
+    Return an `Index` of the children of `sexp`, for repeated lookups by name.
+    A Node keeps its index, so it is only built once, and a LazyNode's index
+    is found without parsing its children.
+    """
+    if isinstance(sexp, (Node, LazyNode)):
+        return sexp.name_index()
+    return Index(sexp)
 
 
 def find(sexp, *names):
     """Return the first node in `sexp` whose name is in `names`"""
+    if isinstance(sexp, (Node, LazyNode)):
+        return sexp.find(*names)
     for child in sexp:
         if len(child) and child[0] in names:
             return child
@@ -84,6 +554,14 @@ def find(sexp, *names):
 
 def find_all(sexp, *names):
     """Yield all nodes in `sexp` whose name is in `names`."""
+    if isinstance(sexp, (Node, LazyNode)):
+        yield from sexp.find_all(*names)
+        return
     for child in sexp:
         if len(child) and child[0] in names:
             yield child
+
+
+def has(sexp, *names):
+    """Return True if `sexp` contains a node whose name is in `names`."""
+    return find(sexp, *names) is not None
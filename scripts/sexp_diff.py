@@ -0,0 +1,206 @@
+"""
+sexp_diff.py
+Copyright 2022 Adam Greig
+Licensed under the MIT licence, see LICENSE file for details.
+
+Structural diff of two KiCad s-expression files, such as .kicad_sym or
+.kicad_mod files.
+
+Usage: sexp_diff.py <old> <new> [--ignore NAME ...] [--limit N]
+
+Rather than comparing lines, child nodes are matched up by their identity:
+symbols, footprints, properties and libraries by name, pins and pads by
+number, and graphic items by layer, falling back to their order among
+otherwise identical siblings. Every subtree is hashed once with sexp.digest,
+so identical subtrees are skipped without being compared, and only the nodes
+which were added, removed or changed are reported.
+
+Exits with status 0 if the files are equivalent and 1 otherwise.
+"""
+
+import sys
+import argparse
+from collections import namedtuple
+
+import sexp
+
+
+# One difference between two trees. `kind` is "added", "removed", "changed"
+# or "reordered", `path` is a tuple of node labels, and `old` and `new` are
+# the nodes (or None) on each side.
+Change = namedtuple("Change", "kind path old new")
+
+# Nodes identified by their first argument.
+NAMED = ("symbol", "footprint", "module", "property", "pad", "fp_text")
+
+# Nodes identified by the value of one of their children.
+KEYED = {"pin": "number", "lib": "name"}
+
+
+def identity(node):
+    """
+    Return the identity of `node` among its siblings: its name, together with
+    whatever distinguishes it from other nodes with the same name.
+    """
+    head = node[0] if node else None
+    if head in NAMED and len(node) > 1 and not isinstance(node[1], list):
+        return head, node[1]
+    key = _value(node, KEYED.get(head))
+    if key is not None:
+        return head, key
+    return head, _value(node, "layer")
+
+
+def _value(node, name):
+    """Return the first argument of the child of `node` called `name`."""
+    for child in node:
+        if isinstance(child, list) and len(child) > 1 and child[0] == name:
+            return child[1]
+
+
+def _children(node):
+    """
+    Return the list children of `node` keyed by identity, with a count added
+    to tell apart siblings with the same identity.
+    """
+    keyed = {}
+    seen = {}
+    for child in node:
+        if isinstance(child, list):
+            ident = identity(child)
+            count = seen.get(ident, 0)
+            seen[ident] = count + 1
+            keyed[ident + (count,)] = child
+    return keyed
+
+
+def _label(key):
+    head, ident, count = key
+    label = str(head)
+    if ident is not None:
+        label += "[{}]".format(ident)
+    if count:
+        label += "#{}".format(count + 1)
+    return label
+
+
+def diff(old, new, ignore=()):
+    """
+    Return a list of the Changes needed to turn the parsed tree `old` into
+    `new`, ignoring any top-level nodes whose names are in `ignore`.
+    """
+    if ignore:
+        old = [n for n in old if not (isinstance(n, list) and n and
+                                      n[0] in ignore)]
+        new = [n for n in new if not (isinstance(n, list) and n and
+                                      n[0] in ignore)]
+    old_hashes, new_hashes = {}, {}
+    sexp.digest(old, old_hashes)
+    sexp.digest(new, new_hashes)
+    changes = []
+    _diff(old, new, (str(old[0]),), old_hashes, new_hashes, changes)
+    return changes
+
+
+def _diff(old, new, path, old_hashes, new_hashes, changes):
+    if old_hashes[id(old)] == new_hashes[id(new)]:
+        return
+    before = len(changes)
+
+    # Arguments which are not lists are compared in order
+    old_atoms = [a for a in old if not isinstance(a, list)]
+    new_atoms = [a for a in new if not isinstance(a, list)]
+    if old_atoms != new_atoms:
+        changes.append(Change("changed", path, old, new))
+        return
+
+    old_children = _children(old)
+    new_children = _children(new)
+    for key, child in old_children.items():
+        if key not in new_children:
+            changes.append(Change("removed", path + (_label(key),),
+                                  child, None))
+    for key, child in new_children.items():
+        if key not in old_children:
+            changes.append(Change("added", path + (_label(key),), None, child))
+        else:
+            _diff(old_children[key], child, path + (_label(key),),
+                  old_hashes, new_hashes, changes)
+
+    # Report any children which are all present but in a different order
+    common = [key for key in old_children if key in new_children]
+    if common != [key for key in new_children if key in old_children]:
+        changes.append(Change("reordered", path, old, new))
+
+    # Otherwise arguments must have moved between the children, which
+    # comparing them separately cannot tell
+    if len(changes) == before:
+        changes.append(Change("changed", path, old, new))
+
+
+def _short(node, limit=100):
+    """Return `node` as a single line of text, truncated to `limit`."""
+    text = _text(node)
+    if len(text) > limit:
+        text = text[:limit - 3] + "..."
+    return text
+
+
+def _text(node):
+    if isinstance(node, list):
+        return "(" + " ".join(_text(child) for child in node) + ")"
+    return str(node)
+
+
+def format_changes(changes, limit=None):
+    """
+    Return lines of text describing `changes`, with at most `limit` changes
+    listed.
+    """
+    lines = []
+    for change in changes[:limit]:
+        path = "/".join(change.path)
+        if change.kind == "added":
+            lines.append("+ {}: {}".format(path, _short(change.new)))
+        elif change.kind == "removed":
+            lines.append("- {}: {}".format(path, _short(change.old)))
+        elif change.kind == "changed":
+            lines.append("~ {}: was {}".format(path, _short(change.old)))
+            lines.append("  {}  now {}".format(" " * len(path),
+                                                _short(change.new)))
+        else:
+            lines.append("~ {}: children reordered".format(path))
+    if limit is not None and len(changes) > limit:
+        lines.append("... and {} more".format(len(changes) - limit))
+    return lines
+
+
+def explain(old, new, ignore=(), limit=20):
+    """
+    Parse the s-expression texts `old` and `new` and return lines of text
+    describing how they differ, for explaining verification failures.
+    """
+    changes = diff(sexp.parse(old), sexp.parse(new), ignore)
+    return format_changes(changes, limit)
+
+
+def main(old, new, ignore, limit):
+    changes = diff(sexp.parse_file(old), sexp.parse_file(new), ignore)
+    for line in format_changes(changes, limit):
+        print(line)
+    return not changes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("old", type=str, help=
+                        "Original file")
+    parser.add_argument("new", type=str, help=
+                        "New file")
+    parser.add_argument("--ignore", type=str, nargs="+", default=[], help=
+                        "Names of top-level nodes to ignore, such as tedit")
+    parser.add_argument("--limit", type=int, default=None, help=
+                        "Maximum number of differences to print")
+    args = vars(parser.parse_args())
+    result = main(**args)
+    sys.exit(0 if result else 1)
@@ -93,20 +93,21 @@ class Module:
         cr.restore()
 
     def _parse(self, mod):
-        self.at = [float(x) for x in sexp.find(mod, "at")[1:]]
+        idx = sexp.index(mod)
+        self.at = [float(x) for x in idx.find("at")[1:]]
         self.bounds = [0, 0, 0, 0]
-        self.layer = sexp.find(mod, "layer")[1]
+        self.layer = idx.find("layer")[1]
 
-        for text in sexp.find_all(mod, "fp_text"):
+        for text in idx.find_all("fp_text"):
             if text[1] == "reference":
                 self.ref = text[2]
             elif text[1] == "value":
                 self.val = text[2]
 
-        for graphic in sexp.find_all(mod, "fp_line", "fp_circle"):
+        for graphic in idx.find_all("fp_line", "fp_circle"):
             self._parse_graphic(graphic)
 
-        for pad in sexp.find_all(mod, "pad"):
+        for pad in idx.find_all("pad"):
             self._parse_pad(pad)
 
     def _parse_graphic(self, graphic):
@@ -125,11 +126,11 @@ class Module:
             self.graphic_layers[layer]["circs"].append((center, r))
 
     def _parse_pad(self, pad):
-        layers = sexp.find(pad, "layers")[1:]
         pad_type = pad[2]
         if pad_type not in ("smd", "thru_hole"):
             return
 
+        layers = sexp.find(pad, "layers")[1:]
         at = [float(x) for x in sexp.find(pad, "at")[1:]]
         size = [float(x) for x in sexp.find(pad, "size")[1:]]
         drill = sexp.find(pad, "drill")
@@ -159,6 +160,11 @@ class Module:
 
 
 class PCB:
+    # Graphics which might be board edges.
+    EDGES = ("gr_line", "gr_arc", "gr_circle")
+    # Top-level nodes used from the board file; the rest are never parsed.
+    HEADS = ("footprint",) + EDGES
+
     def __init__(self, board):
         self.modules = []
         self.edge_lines = []
@@ -296,8 +302,13 @@ class PCB:
         return hl_bounds
 
     def _parse(self, board):
-        for module in sexp.find_all(board, "footprint"):
-            self.modules.append(Module(module))
+        # Separate the footprints from the graphics that might be edges.
+        graphics = []
+        for node in board:
+            if node[0] == "footprint":
+                self.modules.append(Module(node))
+            elif node[0] in PCB.EDGES:
+                graphics.append(node)
 
         # We compute the PCB bounds ourselves rather than relying on the file's
         # area tag which seems to sometimes be wrong. First go based on module
@@ -310,7 +321,7 @@ class PCB:
         ]
 
         # We find all the board edges both for drawing and for bounds
-        self._parse_edges(board)
+        self._parse_edges(graphics)
 
         # Add a slight padding to ensure edge lines are properly drawn
         self.bounds[0] -= 1
@@ -322,7 +333,7 @@ class PCB:
         self.height = self.bounds[3] - self.bounds[1]
 
     def _parse_edges(self, board):
-        for graphic in sexp.find_all(board, "gr_line", "gr_arc", "gr_circle"):
+        for graphic in sexp.find_all(board, *PCB.EDGES):
             layer = sexp.find(graphic, "layer")[1]
             if layer != "Edge.Cuts":
                 continue
@@ -541,8 +552,9 @@ def main():
 
     bom = BOM(args.xmlpath, include=args.include, exclude=args.exclude)
 
-    with open(args.xmlpath[:-3] + "kicad_pcb") as f:
-        pcb = PCB(sexp.parse(f.read()))
+    board = sexp.parse_file(args.xmlpath[:-3] + "kicad_pcb", lazy=True,
+                            heads=PCB.HEADS)
+    pcb = PCB(board[1:])
 
     mm_to_pt = 2.835
     ps = cairo.PDFSurface(args.pdfpath,
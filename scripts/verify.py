@@ -0,0 +1,72 @@
+"""
+verify.py
+Copyright 2022 Adam Greig
+Licensed under the MIT licence, see LICENSE file for details.
+
+Check generated footprints against the files already on disk.
+
+Both sides are first compared as raw bytes with their tedit timestamps masked
+out, which is enough to find identical files without parsing anything. Only
+if that fails are they parsed and compared as trees, which allows for any
+differences in formatting, and sexp_diff is used to list what changed.
+"""
+
+import os
+import re
+
+import sexp
+import sexp_diff
+
+
+# Edit timestamps, which change every time a footprint is generated, and are
+# quoted when they start with a digit.
+_TEDIT = re.compile(rb'\(tedit "?[0-9A-Fa-f]+"?\)')
+
+
+def mask(data):
+    """Return the bytes `data` with any tedit timestamps replaced by zero."""
+    return _TEDIT.sub(b"(tedit 0)", data)
+
+
+def check_footprint(path, fp):
+    """
+    Compare the generated footprint text `fp` with the file at `path`,
+    ignoring tedit. Returns None if they are equivalent, or otherwise a
+    description of how they differ.
+    """
+    try:
+        with open(path, "rb") as f:
+            old = f.read()
+    except FileNotFoundError:
+        return "{} does not exist".format(path)
+
+    new = fp.encode()
+    if old == new or mask(old) == mask(new):
+        return None
+
+    # Otherwise compare the parsed trees, which ignores any formatting changes
+    old = [n for n in sexp.parse(old.decode()) if not _is_tedit(n)]
+    new = [n for n in sexp.parse(fp) if not _is_tedit(n)]
+    if old == new:
+        return None
+    lines = sexp_diff.format_changes(sexp_diff.diff(old, new), limit=20)
+    return "{}:\n  {}".format(path, "\n  ".join(lines))
+
+
+def build_footprint(job):
+    """
+    Generate one footprint and compare it with any existing file, returning
+    its path, contents, and a description of how it differs, or None.
+
+    `job` is a tuple of the footprint directory, a generator function, and
+    the argument to call it with, which returns the footprint's name and
+    text. Used as the worker of the builders which run in parallel.
+    """
+    prettypath, generator, arg = job
+    name, fp = generator(arg)
+    path = os.path.join(prettypath, name + ".kicad_mod")
+    return path, fp, check_footprint(path, fp)
+
+
+def _is_tedit(node):
+    return isinstance(node, list) and len(node) > 0 and node[0] == "tedit"
@@ -0,0 +1,322 @@
+"""
+watch.py
+Copyright 2022 Adam Greig
+Licensed under the MIT licence, see LICENSE file for details.
+
+Rebuild, check and compile the library whenever its sources change.
+
+Usage: watch.py [--poll] [--interval SECONDS] [--verbose]
+
+Runs until interrupted, watching lib/, mod/ and agg.pretty/ with inotify, or
+by polling modification times where inotify is not available or --poll is
+given. Everything is built, checked and compiled once at start-up. After
+that, each change only rebuilds the symbols and footprints whose configs or
+outputs changed, rechecks the libraries and footprints which changed along
+with any libraries referring to a footprint which was added or removed, and
+recompiles agg-kicad.kicad_sym, which only parses the changed libraries
+again.
+
+The scripts are only imported once, and parsed symbols and the results of
+every check are kept in memory between changes.
+"""
+
+import os
+import sys
+import time
+import glob
+import struct
+import select
+import ctypes
+import ctypes.util
+import argparse
+
+import build_lib_ic
+import build_mod_chip
+import build_mod_ic
+import check_lib
+import check_mod
+import compile_lib
+import compile_sym_lib_table
+from build import ROOT, LIBPATH, PRETTYPATH, COMPILED_LIB, SYM_LIB_TABLE
+
+WATCHED = (LIBPATH, "mod/", PRETTYPATH)
+SUFFIXES = (".yaml", ".kicad_sym", ".kicad_mod")
+
+# Seconds to wait for further changes after the first, so that saving
+# several files at once causes only one rebuild.
+SETTLE = 0.1
+
+# inotify flags, from <sys/inotify.h>.
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+
+class Inotify:
+    """Wait for files in `roots` to change, using Linux's inotify."""
+
+    EVENT = struct.Struct("iIII")
+    MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+    def __init__(self, roots):
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self.dirs = {}
+        for root in roots:
+            self.add(root)
+
+    def add(self, root):
+        """Watch `root` and every directory in it, returning their files."""
+        paths = set()
+        for dirpath, dirnames, files in os.walk(root):
+            wd = self.libc.inotify_add_watch(
+                self.fd, os.fsencode(dirpath), self.MASK)
+            if wd < 0:
+                errno = ctypes.get_errno()
+                raise OSError(errno, os.strerror(errno), dirpath)
+            self.dirs[wd] = dirpath
+            paths.update(os.path.join(dirpath, f) for f in files)
+        return paths
+
+    def read(self, changed):
+        """
+        Add the paths named by pending events to `changed`, returning False
+        if events were lost.
+        """
+        data = os.read(self.fd, 65536)
+        offset = 0
+        complete = True
+        while offset < len(data):
+            wd, mask, _, length = self.EVENT.unpack_from(data, offset)
+            offset += self.EVENT.size
+            name = data[offset:offset+length].rstrip(b"\0")
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                complete = False
+            dirpath = self.dirs.get(wd)
+            if dirpath is None or not name:
+                continue
+            path = os.path.join(dirpath, os.fsdecode(name))
+            if mask & IN_ISDIR:
+                # Files may already be in new directories before they are
+                # watched, so treat them all as changed.
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    changed |= self.add(path)
+            else:
+                changed.add(path)
+        return complete
+
+    def wait(self):
+        """
+        Block until files change, returning their paths, or None if too many
+        changed at once to say which.
+        """
+        changed = set()
+        complete = True
+        ready = select.select([self.fd], [], [])[0]
+        while ready:
+            complete &= self.read(changed)
+            ready = select.select([self.fd], [], [], SETTLE)[0]
+        return changed if complete else None
+
+
+class Poller:
+    """Wait for files in `roots` to change, checking every `interval`s."""
+
+    def __init__(self, roots, interval):
+        self.roots = roots
+        self.interval = interval
+        self.seen = self.scan()
+
+    def scan(self):
+        """Return the modification time and size of every file watched."""
+        seen = {}
+        for root in self.roots:
+            for dirpath, dirnames, files in os.walk(root):
+                for f in files:
+                    path = os.path.join(dirpath, f)
+                    try:
+                        st = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    seen[path] = (st.st_mtime_ns, st.st_size)
+        return seen
+
+    def wait(self):
+        """Block until files change, returning their paths."""
+        while True:
+            time.sleep(self.interval)
+            seen = self.scan()
+            changed = {path for path in seen.keys() | self.seen.keys()
+                       if seen.get(path) != self.seen.get(path)}
+            self.seen = seen
+            if changed:
+                return changed
+
+
+class Library:
+    """
+    The parsed symbols and check results of every library and footprint,
+    kept between changes.
+    """
+
+    def __init__(self, verbose=False):
+        self.verbose = verbose
+        self.symbols = {}
+        self.lib_errs = {}
+        self.mod_errs = {}
+
+    def update(self, changed=None):
+        """
+        Rebuild, check and compile whatever depends on the files in
+        `changed`, or everything if it is None.
+        """
+        start = time.perf_counter()
+        self.build(changed)
+        if changed is None:
+            libs = sorted(glob.glob(os.path.join(LIBPATH, "**", "*.kicad_sym"),
+                                    recursive=True))
+            mods = sorted(glob.glob(os.path.join(PRETTYPATH, "*.kicad_mod")))
+        else:
+            libs = sorted(p for p in changed if p.endswith(".kicad_sym"))
+            mods = sorted(p for p in changed if p.endswith(".kicad_mod"))
+        # The symbol table only lists libraries, so needs updating only when
+        # they are added or removed.
+        table = changed is None or any(
+            os.path.exists(path) != (path in self.lib_errs) for path in libs)
+        self.check_mods(mods)
+        self.check_libs(libs)
+        if libs:
+            self.compile(table)
+
+        print("{}: {} libraries and {} footprints with errors ({:.2f}s)"
+              .format(time.strftime("%H:%M:%S"),
+                      sum(1 for errs in self.lib_errs.values() if errs),
+                      sum(1 for errs in self.mod_errs.values() if errs),
+                      time.perf_counter() - start))
+
+    def build(self, changed):
+        """Regenerate the symbols and footprints built from `changed`."""
+        paths = None
+        if changed is not None:
+            paths = {os.path.abspath(path) for path in changed}
+        builders = (
+            (LIBPATH, lambda: build_lib_ic.main(LIBPATH, paths=paths)),
+            ("mod/ic", lambda: build_mod_ic.main(
+                PRETTYPATH, "mod/ic", jobs=1, paths=paths)),
+            ("mod/chip", lambda: build_mod_chip.main(
+                PRETTYPATH, "mod/chip", jobs=1, paths=paths)),
+        )
+        for path, build in builders:
+            try:
+                build()
+            except Exception as e:
+                print("Error: building {} failed: {}".format(path, e),
+                      file=sys.stderr)
+
+    def check_libs(self, libs):
+        """Check the libraries `libs`, forgetting any which were removed."""
+        for path in libs:
+            if not os.path.exists(path):
+                self.symbols.pop(path, None)
+                self.lib_errs.pop(path, None)
+                continue
+            try:
+                self.symbols[path] = check_lib.parse(path)
+            except Exception as e:
+                self.symbols.pop(path, None)
+                self.lib_errs[path] = ["Could not parse: {}".format(e)]
+                check_lib.report(path, self.lib_errs[path])
+                continue
+            self.check_lib(path)
+
+    def check_lib(self, path):
+        errs, _ = check_lib.check(path, PRETTYPATH, self.symbols[path])
+        self.lib_errs[path] = errs
+        check_lib.report(path, errs, self.verbose)
+
+    def check_mods(self, mods):
+        """
+        Check the footprints `mods`, forgetting any which were removed, and
+        recheck libraries referring to any footprints added or removed.
+        """
+        moved = set()
+        for path in mods:
+            name = os.path.splitext(os.path.basename(path))[0]
+            if not os.path.exists(path):
+                if self.mod_errs.pop(path, None) is not None:
+                    moved.add("agg:" + name)
+                continue
+            if path not in self.mod_errs:
+                moved.add("agg:" + name)
+            if path in check_mod.SKIP:
+                self.mod_errs[path] = []
+                continue
+            try:
+                results, _ = check_mod.check(path)
+            except Exception as e:
+                results = [check_mod.Result(path, "parse", str(e))]
+            self.mod_errs[path] = results
+            check_mod.report(path, results, self.verbose)
+
+        if moved:
+            for path, symbols in self.symbols.items():
+                if any(symbol.fp in moved for symbol in symbols):
+                    self.check_lib(path)
+
+    def compile(self, table):
+        """Recompile the library, and the symbol table too if `table`."""
+        try:
+            compile_lib.writelib(LIBPATH, COMPILED_LIB)
+            if table:
+                compile_sym_lib_table.writetable(LIBPATH, SYM_LIB_TABLE)
+        except Exception as e:
+            print("Error: compiling failed: {}".format(e), file=sys.stderr)
+
+
+def main(poll=False, interval=1.0, verbose=False):
+    os.chdir(ROOT)
+
+    watcher = None
+    if not poll:
+        try:
+            watcher = Inotify(WATCHED)
+        except (OSError, AttributeError) as e:
+            print("Cannot use inotify ({}), polling instead.".format(e),
+                  file=sys.stderr)
+    if watcher is None:
+        watcher = Poller(WATCHED, interval)
+
+    library = Library(verbose)
+    library.update()
+    try:
+        while True:
+            changed = watcher.wait()
+            if changed is not None:
+                changed = {path for path in changed if path.endswith(SUFFIXES)}
+                if not changed:
+                    continue
+            library.update(changed)
+    except KeyboardInterrupt:
+        return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--poll", action="store_true", help=
+                        "Poll for changes instead of using inotify")
+    parser.add_argument("--interval", type=float, default=1.0, help=
+                        "Seconds between polls, default 1")
+    parser.add_argument("--verbose", action="store_true", help=
+                        "Print out every file checked even if OK")
+    args = vars(parser.parse_args())
+    result = main(**args)
+    sys.exit(0 if result else 1)